@@ -0,0 +1,18 @@
+"""Production-only WSGI entry for Vercel.
+
+Pins the deploy-target environment before ``api.app`` is imported so that
+module resolves straight to the Neon/NullPool configuration and never
+evaluates its SQLite or development branches.
+"""
+import os
+
+# Fixed deploy target: Vercel production against PostgreSQL/Neon
+os.environ['VERCEL'] = '1'
+os.environ.setdefault('VERCEL_ENV', 'production')
+os.environ.setdefault('DEBUG', 'False')
+
+from .app import app, db  # noqa: E402
+
+application = app
+
+__all__ = ["app", "application", "db"]
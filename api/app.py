@@ -1,42 +1,117 @@
 import os
+import hashlib
 import logging
-import traceback
+import time
+from functools import lru_cache
+from urllib.parse import parse_qs, urlsplit, urlunsplit
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Enum, Float, Numeric, inspect
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import NullPool
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging with more detailed format for debugging
-logging.basicConfig(
-    level=logging.DEBUG,  # More verbose logging for debugging
-    format='%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-)
-
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
 
+def dialect_insert(table):
+    """INSERT construct for the active backend (both support ON CONFLICT)"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+# Accepted spellings for boolean environment flags
+_TRUTHY = frozenset({'true', '1', 'yes', 'on'})
+
+def _bool_env(environ, key, default='false'):
+    """Parse a boolean flag from an environment mapping"""
+    return environ.get(key, default).lower() in _TRUTHY
+
+class _Env:
+    """Snapshot of the environment variables read during app initialization.
+
+    Every cold start re-imports this module, so the environment is read once
+    here and integer settings are parsed up front instead of calling
+    ``os.getenv`` at each use site.
+    """
+    __slots__ = (
+        'VERCEL', 'VERCEL_ENV', 'REPLIT_ENVIRONMENT', 'DATABASE_URL',
+        'SESSION_SECRET', 'SECRET_KEY', 'APP_NAME', 'DB_CONNECT_TIMEOUT',
+        'DB_POOL_SIZE', 'DB_POOL_RECYCLE', 'DB_POOL_TIMEOUT', 'DB_MAX_OVERFLOW',
+        'DB_SSL_NEGOTIATION', 'TELEGRAM_BOT_TOKEN', 'BOT_OWNER_ID', 'DEBUG', 'FLASK_ENV',
+    )
+
+    def __init__(self, environ):
+        self.VERCEL = environ.get('VERCEL')
+        self.VERCEL_ENV = environ.get('VERCEL_ENV')
+        self.REPLIT_ENVIRONMENT = environ.get('REPLIT_ENVIRONMENT')
+        self.DATABASE_URL = environ.get('DATABASE_URL')
+        self.SESSION_SECRET = environ.get('SESSION_SECRET')
+        self.SECRET_KEY = environ.get('SECRET_KEY')
+        self.APP_NAME = environ.get('APP_NAME', 'founders-management')
+        self.DB_CONNECT_TIMEOUT = int(environ.get('DB_CONNECT_TIMEOUT', '30'))
+        self.DB_POOL_SIZE = int(environ.get('DB_POOL_SIZE', '1'))
+        self.DB_POOL_RECYCLE = int(environ.get('DB_POOL_RECYCLE', '300'))
+        self.DB_POOL_TIMEOUT = int(environ.get('DB_POOL_TIMEOUT', '10'))
+        self.DB_MAX_OVERFLOW = int(environ.get('DB_MAX_OVERFLOW', '0'))
+        self.DB_SSL_NEGOTIATION = environ.get('DB_SSL_NEGOTIATION')
+        self.TELEGRAM_BOT_TOKEN = environ.get('TELEGRAM_BOT_TOKEN', '')
+        self.BOT_OWNER_ID = int(environ.get('BOT_OWNER_ID', '0'))
+        self.DEBUG = _bool_env(environ, 'DEBUG')
+        self.FLASK_ENV = environ.get('FLASK_ENV', 'production')
+
+_ENV = _Env(os.environ.copy())
+
 # Environment detection for consistent behavior
+@lru_cache(maxsize=1)
 def detect_environment():
     """Detect if running in Vercel, Replit, or other environment"""
-    if os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'):
+    if _ENV.VERCEL or _ENV.VERCEL_ENV:
         return 'vercel'
-    elif os.environ.get('REPLIT_ENVIRONMENT'):
+    elif _ENV.REPLIT_ENVIRONMENT:
         return 'replit' 
-    elif os.environ.get('DATABASE_URL', '').startswith('postgresql'):
+    elif (_ENV.DATABASE_URL or '').startswith('postgresql'):
         return 'production'
     else:
         return 'development'
 
+ENVIRONMENT = detect_environment()
+
+# Verbose DEBUG logging only outside serverless/production deployments
+if ENVIRONMENT in ('vercel', 'production'):
+    # Platform logs are already timestamped; skip strftime and caller frame lookups
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging._srcfile = None
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(name)s %(message)s')
+else:
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+    )
+
+def _neon_pooler_url(url):
+    """Point a direct Neon endpoint URL at its pgbouncer (-pooler) host"""
+    parts = urlsplit(url)
+    endpoint, _, domain = (parts.hostname or '').partition('.')
+    if not domain.endswith('neon.tech') or endpoint.endswith('-pooler'):
+        return url
+    userinfo, at, hostport = parts.netloc.rpartition('@')
+    netloc = userinfo + at + hostport.replace(endpoint, endpoint + '-pooler', 1)
+    return urlunsplit(parts._replace(netloc=netloc))
+
 # Create the app with proper template and static paths for Vercel
-template_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
-static_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+_BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+template_dir = os.path.join(_BASE, 'templates')
+static_dir = os.path.join(_BASE, 'static')
 app = Flask(__name__, template_folder=template_dir, static_folder=static_dir, instance_relative_config=False)
 
-environment = detect_environment()
-app.secret_key = os.getenv("SESSION_SECRET") or os.getenv("SECRET_KEY") or "dev-session-secret-key-change-for-production"
-if environment in ['vercel', 'production'] and app.secret_key == "dev-session-secret-key-change-for-production":
+app.secret_key = _ENV.SESSION_SECRET or _ENV.SECRET_KEY or "dev-session-secret-key-change-for-production"
+if ENVIRONMENT in ['vercel', 'production'] and app.secret_key == "dev-session-secret-key-change-for-production":
     # For Vercel, use a generated secret if none provided (will warn but not crash)
     import secrets
     app.secret_key = secrets.token_urlsafe(32)
@@ -44,52 +119,68 @@ if environment in ['vercel', 'production'] and app.secret_key == "dev-session-se
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database - Use SQLite for development, PostgreSQL for production
-database_url = os.getenv("DATABASE_URL")
+database_url = _ENV.DATABASE_URL
 
 # For development/Replit, use SQLite if no DATABASE_URL is provided
 if not database_url:
-    if environment in ['replit', 'development']:
+    if ENVIRONMENT in ['replit', 'development']:
         database_url = "sqlite:///founders_management.db"
         logging.info("Using SQLite database for development")
     else:
         raise ValueError("DATABASE_URL environment variable is required for production.")
 
 # Allow both SQLite and PostgreSQL based on environment
-if environment in ['replit', 'development'] and not database_url.startswith(("postgresql", "sqlite")):
+if ENVIRONMENT in ['replit', 'development'] and not database_url.startswith(("postgresql", "sqlite")):
     # Default to SQLite for development
     database_url = "sqlite:///founders_management.db"
-elif environment in ['vercel', 'production'] and not database_url.startswith("postgresql"):
+elif ENVIRONMENT in ['vercel', 'production'] and not database_url.startswith("postgresql"):
     raise ValueError("DATABASE_URL must be a PostgreSQL connection string for production environments.")
 
 # Configure database settings based on environment
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 
 if database_url.startswith("postgresql"):
-    # PostgreSQL/Neon configuration
-    ssl_mode = "require"
-    if "sslmode=require" in database_url:
-        ssl_mode = "require"
-    elif "sslmode=prefer" in database_url:
-        ssl_mode = "prefer"
-    elif "sslmode=disable" in database_url:
-        ssl_mode = "disable"
-
-    # PostgreSQL connection settings
+    # PostgreSQL/Neon configuration - honour any sslmode in the URL (including
+    # verify-ca/verify-full), defaulting to require
+    ssl_mode = parse_qs(urlsplit(database_url).query).get("sslmode", ["require"])[0]
+
+    # PostgreSQL connection settings - waking a suspended Neon compute can take
+    # longer than 10s, and keepalives stop idle sockets being dropped silently
     connect_args = {
-        "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10")),
+        "connect_timeout": _ENV.DB_CONNECT_TIMEOUT,
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 5,
         "sslmode": ssl_mode,
-        "application_name": os.getenv("APP_NAME", "founders-management")
+        "application_name": _ENV.APP_NAME
     }
 
-    # Engine options optimized for PostgreSQL
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_size": int(os.getenv("DB_POOL_SIZE", "1")),  # Smaller pool for serverless
-        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
-        "pool_pre_ping": True,
-        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),  # Shorter timeout for serverless
-        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "0")),
-        "connect_args": connect_args
-    }
+    # Neon accepts direct TLS negotiation, which skips the SSLRequest round trip
+    # libpq otherwise performs before every handshake - the bulk of first-query
+    # latency on a Vercel cold start. Requires libpq 17, so it is opt-in.
+    if ENVIRONMENT == 'vercel' and _ENV.DB_SSL_NEGOTIATION and ssl_mode in ("require", "verify-ca", "verify-full"):
+        connect_args["sslnegotiation"] = _ENV.DB_SSL_NEGOTIATION
+
+    if ENVIRONMENT == 'vercel':
+        # A serverless container may never see a second request, so keep no
+        # local pool (and no pre-ping round trip); Neon's pgbouncer endpoint
+        # pools connections on the server side instead
+        app.config["SQLALCHEMY_DATABASE_URI"] = _neon_pooler_url(database_url)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "poolclass": NullPool,
+            "connect_args": connect_args
+        }
+    else:
+        # Engine options optimized for PostgreSQL
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "pool_size": _ENV.DB_POOL_SIZE,
+            "pool_recycle": _ENV.DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+            "pool_timeout": _ENV.DB_POOL_TIMEOUT,
+            "max_overflow": _ENV.DB_MAX_OVERFLOW,
+            "connect_args": connect_args
+        }
 else:
     # SQLite configuration for development
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
@@ -103,7 +194,7 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 # Configure session for better authentication caching
 from datetime import timedelta
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)  # 30 days for better caching
-app.config['SESSION_COOKIE_SECURE'] = environment in ['vercel', 'production']  # Use HTTPS only in production
+app.config['SESSION_COOKIE_SECURE'] = ENVIRONMENT in ['vercel', 'production']  # Use HTTPS only in production
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevent XSS attacks
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection while allowing Telegram WebApp
 
@@ -114,7 +205,7 @@ try:
     logging.debug("SQLAlchemy initialization successful")
 except Exception as init_error:
     logging.error(f"SQLAlchemy init_app failed: {init_error}")
-    logging.error(f"SQLAlchemy init traceback: {traceback.format_exc()}")
+    logging.error("SQLAlchemy init traceback", exc_info=True)
     if 'issubclass' in str(init_error).lower():
         logging.error("DETECTED: issubclass() error during SQLAlchemy initialization!")
     raise
@@ -128,58 +219,186 @@ try:
         logging.debug("Models imported successfully")
         
         # Debug: Check if models are properly defined classes
-        logging.debug(f"User model type: {type(models.User)}")
-        logging.debug(f"User model MRO: {models.User.__mro__ if hasattr(models.User, '__mro__') else 'No MRO'}")
-        logging.debug(f"Purchase model type: {type(models.Purchase)}")
-        logging.debug(f"Sale model type: {type(models.Sale)}")
-        logging.debug(f"ExchangeRate model type: {type(models.ExchangeRate)}")
+        logging.debug("User model type: %s", type(models.User))
+        logging.debug("Purchase model type: %s", type(models.Purchase))
+        logging.debug("Sale model type: %s", type(models.Sale))
+        logging.debug("ExchangeRate model type: %s", type(models.ExchangeRate))
         
 except Exception as model_import_error:
     logging.error(f"CRITICAL: Model import failed: {model_import_error}")
-    logging.error(f"Model import error traceback: {traceback.format_exc()}")
+    logging.error("Model import error traceback", exc_info=True)
     raise
 
 # App configuration using environment variables
 app.config.update(
-    TELEGRAM_BOT_TOKEN=os.getenv("TELEGRAM_BOT_TOKEN", ""),
-    BOT_OWNER_ID=int(os.getenv("BOT_OWNER_ID", "0")),
-    DEBUG=os.getenv("DEBUG", "False").lower() in ("true", "1", "yes"),
-    ENV=os.getenv("FLASK_ENV", "production")
+    TELEGRAM_BOT_TOKEN=_ENV.TELEGRAM_BOT_TOKEN,
+    BOT_OWNER_ID=_ENV.BOT_OWNER_ID,
+    DEBUG=_ENV.DEBUG,
+    ENV=_ENV.FLASK_ENV
 )
 
+def _schema_version():
+    """Fingerprint of the model tables, columns (type and server default) and indexes"""
+    layout = sorted(
+        (
+            table.name,
+            sorted(
+                (column.name, repr(column.type), str(column.server_default.arg) if column.server_default else None)
+                for column in table.columns
+            ),
+            sorted(index.name for index in table.indexes),
+        )
+        for table in db.metadata.tables.values()
+    )
+    return hashlib.sha256(repr(layout).encode()).hexdigest()
+
+def _column_type_changed(model_type, current_type):
+    """True when an existing column needs converting to the model type (float -> NUMERIC, varchar -> ENUM)"""
+    if isinstance(model_type, Enum):
+        return not isinstance(current_type, Enum)
+    return (isinstance(model_type, Numeric) and not isinstance(model_type, Float)
+            and isinstance(current_type, Float))
+
+def _upgrade_columns():
+    """Bring existing PostgreSQL columns in line with the model types and server defaults"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name']: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                current = existing.get(column.name)
+                if current is None:
+                    continue
+                if _column_type_changed(column.type, current['type']):
+                    if isinstance(column.type, Enum):
+                        # create_all() only creates the enum type alongside a new table
+                        column.type.create(connection, checkfirst=True)
+                    type_sql = column.type.compile(dialect=connection.dialect)
+                    logging.info(f"Converting {table.name}.{column.name} to {type_sql}")
+                    connection.execute(db.text(
+                        f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" '
+                        f'TYPE {type_sql} USING "{column.name}"::{type_sql}'
+                    ))
+                if column.server_default is not None and current['default'] is None:
+                    default_sql = column.server_default.arg.compile(dialect=connection.dialect)
+                    logging.info(f"Setting {table.name}.{column.name} default to {default_sql}")
+                    connection.execute(db.text(
+                        f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" SET DEFAULT {default_sql}'
+                    ))
+
+# Tables that only cache derived data, so duplicates blocking a new unique
+# index may be discarded; anywhere else they need a manual migration
+_DEDUPE_TABLES = frozenset({'exchangerate'})
+# Indexes removed from the models that older databases may still carry
+_RETIRED_INDEXES = ('ix_exchangerate_pair_updated',)
+
+def _ensure_indexes():
+    """Create model indexes missing from tables that create_all() left untouched"""
+    with db.engine.begin() as connection:
+        for name in _RETIRED_INDEXES:
+            connection.execute(db.text(f'DROP INDEX IF EXISTS "{name}"'))
+        inspector = inspect(connection)
+        for table in db.metadata.sorted_tables:
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    newest = db.select(db.func.max(table.c.id)).group_by(*index.columns)
+                    duplicates = db.select(db.func.count()).select_from(table).where(table.c.id.not_in(newest))
+                    if connection.execute(duplicates).scalar():
+                        if table.name not in _DEDUPE_TABLES:
+                            raise RuntimeError(
+                                f"{table.name} has duplicate rows for unique index {index.name}; "
+                                f"resolve them manually before deploying"
+                            )
+                        # Cached rows: keep the newest of each group
+                        removed = connection.execute(db.delete(table).where(table.c.id.not_in(newest))).rowcount
+                        logging.warning(f"Removed {removed} duplicate {table.name} rows before creating {index.name}")
+                index.create(connection)
+
+def _warm_pool(size):
+    """Open ``size`` pooled connections in parallel so the first requests reuse them"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    engine = db.engine  # resolved here - worker threads have no app context
+    
+    def checkout():
+        connection = engine.connect()
+        connection.execute(db.text("SELECT 1"))
+        return connection
+    
+    with ThreadPoolExecutor(max_workers=size) as executor:
+        futures = [executor.submit(checkout) for _ in range(size)]
+    
+    failures = [future.exception() for future in futures if future.exception()]
+    for future in futures:
+        if not future.exception():
+            future.result().close()  # returns the live connection to the pool
+    if failures:
+        # Connections are opened lazily anyway; a cold pool only costs latency
+        logging.warning(f"Warmed {size - len(failures)} of {size} database connections: {failures[0]}")
+        return
+    logging.info(f"Warmed {size} database connections")
+
+# After a failed initialization, requests skip retrying for this long so a
+# persistent failure does not re-run the schema checks on every request
+_INIT_RETRY_SECONDS = 60
+
 # Initialize database and create tables
 def init_database():
     """Initialize database tables and create default admin user"""
+    # Warm invocations reuse the process: the database is already set up
+    if getattr(app, "_db_inited", False):
+        return
+    failed_at = getattr(app, "_db_init_failed_at", None)
+    if failed_at is not None and time.monotonic() - failed_at < _INIT_RETRY_SECONDS:
+        return
     try:
         logging.debug("Starting database initialization...")
         logging.info("Models already imported")
         
-        # Debug: Check database and model registry state
-        logging.debug(f"Database instance: {db}")
-        logging.debug(f"Database models registry: {list(db.Model.registry._class_registry.keys()) if hasattr(db.Model, 'registry') and hasattr(db.Model.registry, '_class_registry') else 'No registry found'}")
+        # Skip create_all() when the database already matches the models
+        schema_version = _schema_version()
+        # Read on a short-lived connection: a session transaction left open here
+        # would hold a pooled connection while the upgrade steps below check out
+        # their own, exhausting a single-connection pool
+        try:
+            with db.engine.connect() as connection:
+                stored_version = connection.execute(db.text("SELECT schema_version FROM _meta")).scalar()
+        except Exception:
+            stored_version = None
         
         # Create all tables with detailed error handling
-        logging.debug("Calling db.create_all()...")
-        try:
-            db.create_all()
-            logging.info("Database tables created successfully")
-        except Exception as create_tables_error:
-            error_str = str(create_tables_error).lower()
-            if 'duplicate key' in error_str or 'already exists' in error_str:
-                logging.info("Database tables already exist - skipping creation")
-            else:
-                logging.error(f"db.create_all() failed: {create_tables_error}")
-                logging.error(f"Create tables traceback: {traceback.format_exc()}")
-                if 'issubclass' in error_str:
-                    logging.error("DETECTED: issubclass() error during db.create_all()!")
-                    logging.debug("Checking model classes before create_all...")
-                    from . import models
-                    for model_name in ['User', 'Purchase', 'Sale', 'ExchangeRate']:
-                        model_class = getattr(models, model_name, None)
-                        logging.debug(f"{model_name} class: {model_class}")
-                        logging.debug(f"{model_name} type: {type(model_class)}")
-                        logging.debug(f"{model_name} is class: {isinstance(model_class, type) if model_class else 'None'}")
-                raise
+        if stored_version == schema_version:
+            logging.info("Database schema is up to date - skipping table creation")
+        else:
+            logging.debug("Calling db.create_all()...")
+            try:
+                db.create_all()
+                _upgrade_columns()
+                _ensure_indexes()
+                db.session.execute(db.text("CREATE TABLE IF NOT EXISTS _meta (schema_version TEXT)"))
+                db.session.execute(db.text("DELETE FROM _meta"))
+                db.session.execute(db.text("INSERT INTO _meta (schema_version) VALUES (:version)"), {"version": schema_version})
+                db.session.commit()
+                logging.info("Database tables created successfully")
+            except Exception as create_tables_error:
+                db.session.rollback()
+                error_str = str(create_tables_error).lower()
+                if 'duplicate key' in error_str or 'already exists' in error_str:
+                    logging.info("Database tables already exist - skipping creation")
+                else:
+                    logging.error(f"db.create_all() failed: {create_tables_error}")
+                    logging.error("Create tables traceback", exc_info=True)
+                    if 'issubclass' in error_str:
+                        logging.error("DETECTED: issubclass() error during db.create_all()!")
+                    raise
         
         # Log database connection info (without credentials)
         db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
@@ -188,19 +407,22 @@ def init_database():
         else:
             logging.info("Using SQLite database (development)")
         
-        # Test database connection with retry for serverless
-        max_retries = 3
-        for attempt in range(max_retries):
+        # Pre-populate a multi-connection pool so the first burst of requests
+        # finds open sockets; serverless (NullPool) connects lazily instead
+        warm_connections = min(_ENV.DB_POOL_SIZE, 4)
+        if ENVIRONMENT != 'vercel' and db_uri.startswith('postgresql') and warm_connections > 1:
+            # Return any connection the session holds so every slot is free
+            db.session.close()
+            _warm_pool(warm_connections)
+        else:
+            # Single connectivity check - pool_pre_ping already recycles stale
+            # connections, so retrying here only multiplies cold-start latency
             try:
-                result = db.session.execute(db.text("SELECT 1")).scalar()
-                if result == 1:
-                    logging.info(f"Database connection test successful (attempt {attempt + 1})")
-                    break
-                else:
-                    logging.warning(f"Database connection test returned unexpected result (attempt {attempt + 1})")
+                db.session.execute(db.text("SELECT 1")).scalar()
+                logging.info("Database connection test successful")
             except Exception as conn_error:
-                logging.warning(f"Database connection attempt {attempt + 1} failed: {conn_error}")
-                if attempt == max_retries - 1:
+                logging.warning(f"Database connection test failed: {conn_error}")
+                if ENVIRONMENT != 'vercel':
                     raise
         
         # Create default bot owner if specified
@@ -208,180 +430,138 @@ def init_database():
             logging.info(f"Checking for bot owner with ID: {app.config['BOT_OWNER_ID']}")
             # Import models in local scope to ensure it's available
             from . import models
-            existing_owner = models.User.query.filter_by(telegram_id=app.config['BOT_OWNER_ID']).first()
-            if not existing_owner:
-                owner = models.User()
-                owner.telegram_id = app.config['BOT_OWNER_ID']
-                owner.first_name = "Bot"
-                owner.last_name = "Owner" 
-                owner.username = "bot_owner"
-                owner.is_admin = True
-                owner.is_whitelisted = True
-                db.session.add(owner)
-                db.session.commit()
+            # One idempotent round trip instead of SELECT + optional INSERT
+            stmt = dialect_insert(models.User.__table__).values(
+                telegram_id=app.config['BOT_OWNER_ID'],
+                first_name="Bot",
+                last_name="Owner",
+                username="bot_owner",
+                is_admin=True,
+                is_whitelisted=True,
+            ).on_conflict_do_nothing(index_elements=['telegram_id'])
+            result = db.session.execute(stmt)
+            db.session.commit()
+            if result.rowcount:
                 logging.info(f"Created bot owner with ID: {app.config['BOT_OWNER_ID']}")
             else:
                 logging.info(f"Bot owner already exists with ID: {app.config['BOT_OWNER_ID']}")
+        
+        app._db_inited = True
                 
     except Exception as e:
-        logging.error(f"Database initialization error: {e}")
-        logging.error(f"Database error traceback: {traceback.format_exc()}")
+        app._db_init_failed_at = time.monotonic()
+        logging.error(f"Database initialization error (retrying in {_INIT_RETRY_SECONDS}s): {e}")
+        logging.error("Database error traceback", exc_info=True)
         
         # Check if this is the issubclass error
         if 'issubclass' in str(e).lower():
             logging.error("DETECTED: issubclass() error in database initialization!")
-            logging.debug("Attempting to diagnose issubclass error...")
-            
-            # Try to import models individually to isolate the problem
+        
+        # Compare the tables the database actually has against the models
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
             try:
-                from . import models
-                logging.debug("Models module imported successfully during error handling")
-                
-                # Check each model class individually
-                for model_name in ['User', 'Purchase', 'Sale', 'ExchangeRate']:
-                    try:
-                        model_class = getattr(models, model_name, None)
-                        if model_class:
-                            logging.debug(f"{model_name}: {model_class} (type: {type(model_class)})")
-                            logging.debug(f"{model_name} bases: {getattr(model_class, '__bases__', 'No bases')}")
-                            logging.debug(f"{model_name} mro: {getattr(model_class, '__mro__', 'No MRO')}")
-                        else:
-                            logging.error(f"{model_name} is None!")
-                    except Exception as model_check_error:
-                        logging.error(f"Error checking {model_name}: {model_check_error}")
-            except Exception as models_import_error:
-                logging.error(f"Failed to import models during error diagnosis: {models_import_error}")
+                logging.debug("Model tables: %s", sorted(db.metadata.tables))
+                logging.debug("Database tables: %s", inspect(db.engine).get_table_names())
+            except Exception as inspect_error:
+                logging.debug("Could not inspect database tables: %s", inspect_error)
+
+def boot_database():
+    """Run init_database() on the first request handled by this process"""
+    if getattr(app, "_db_inited", False):
+        return
+    
+    # For Vercel, be more conservative with database initialization
+    if ENVIRONMENT == 'vercel':
+        logging.info("Initializing database for Vercel environment")
+        try:
+            init_database()
+        except Exception as db_error:
+            logging.error(f"Database initialization failed in Vercel: {db_error}")
+            # Don't fail the request if DB init fails in serverless
+    else:
+        init_database()
 
 # Initialize database and routes
 def create_app():
     """Create and configure the Flask application"""
-    environment = detect_environment()
-    logging.debug(f"Creating app for environment: {environment}")
+    logging.debug(f"Creating app for environment: {ENVIRONMENT}")
     
     try:
-        # Import utils for template functions first
-        logging.debug("Importing utils for template functions...")
-        from .utils import format_gold_quantity, format_currency
-        logging.debug("Utils imported successfully")
-        
-        # Make format functions available in templates
-        logging.debug("Registering template functions...")
-        app.jinja_env.globals.update(
-            format_gold_quantity=format_gold_quantity,
-            format_currency=format_currency
-        )
-        logging.debug("Template functions registered")
-        
         with app.app_context():
-            # For Vercel, be more conservative with database initialization
-            if environment == 'vercel':
-                logging.info("Initializing database for Vercel environment")
-                try:
-                    init_database()
-                except Exception as db_error:
-                    logging.error(f"Database initialization failed in Vercel: {db_error}")
-                    # Don't fail the entire app if DB fails in serverless
-                    pass
-            else:
-                init_database()
-            
-            # Import routes after database initialization to avoid circular imports
+            # Routes must be registered at import time - Flask rejects new URL
+            # rules once the first request has been handled
             logging.debug("Importing routes...")
             from . import routes
             logging.info("Routes imported successfully")
-            logging.debug(f"Number of registered routes: {len(app.url_map._rules)}")
+            logging.debug("Number of registered routes: %d", len(app.url_map._rules))
+        
+        # Database initialization waits for the first request so cold starts
+        # don't block on table creation and a database round trip
+        app.before_request(boot_database)
         
         return app
         
     except Exception as e:
         logging.error(f"CRITICAL: App initialization error: {e}")
-        logging.error(f"App initialization traceback: {traceback.format_exc()}")
+        logging.error("App initialization traceback", exc_info=True)
         
         # Enhanced debug information
-        logging.debug(f"Error type: {type(e).__name__}")
-        logging.debug(f"Error args: {e.args}")
+        logging.debug("Error type: %s", type(e).__name__)
+        logging.debug("Error args: %s", e.args)
         
         # Check if this is the issubclass error we're looking for
         if 'issubclass' in str(e).lower():
             logging.error("DETECTED: issubclass() error in app initialization!")
-            logging.debug(f"App state: {vars(app) if hasattr(app, '__dict__') else 'No app dict'}")
-            logging.debug(f"DB state: {vars(db) if hasattr(db, '__dict__') else 'No db dict'}")
-        
-        # Fallback - still register template functions
-        try:
-            logging.debug("Attempting fallback template function registration...")
-            from .utils import format_gold_quantity, format_currency
-            app.jinja_env.globals.update(
-                format_gold_quantity=format_gold_quantity,
-                format_currency=format_currency
-            )
-            logging.info("Template functions registered in fallback mode")
-        except Exception as template_error:
-            logging.error(f"Template function registration failed: {template_error}")
-            logging.error(f"Template error traceback: {traceback.format_exc()}")
+            logging.debug("App state: %s", app)
+            logging.debug("DB state: %s", db)
         
         return app
 
-# Register template functions globally before app initialization
-try:
-    logging.debug("Attempting early template function registration...")
+def _register_template_globals():
+    """Make the formatting helpers available to every template"""
     from .utils import format_gold_quantity, format_currency
     app.jinja_env.globals.update(
         format_gold_quantity=format_gold_quantity,
         format_currency=format_currency
     )
+
+# Register template functions once, before app initialization
+try:
+    _register_template_globals()
     logging.info("Template functions registered successfully")
 except Exception as e:
     logging.error(f"Failed to register template functions: {e}")
-    logging.error(f"Template function error traceback: {traceback.format_exc()}")
+    logging.error("Template function error traceback", exc_info=True)
     
     # Check if this is related to our issubclass error
     if 'issubclass' in str(e).lower():
         logging.error("DETECTED: issubclass() error in template function registration!")
 
-environment = detect_environment()
-logging.info(f"Detected environment: {environment}")
+logging.info(f"Detected environment: {ENVIRONMENT}")
 
 # Initialize the app based on environment
 app_instance = None
 try:
-    if environment in ['vercel', 'production']:
-        logging.info(f"Initializing app for {environment}")
-        # For serverless environments, ensure minimal initialization
-        app_instance = create_app()
-    else:
-        logging.info(f"Initializing app for {environment}")
-        app_instance = create_app()
-        
-    logging.info("Routes already imported at module level")
+    logging.info(f"Initializing app for {ENVIRONMENT}")
+    app_instance = create_app()
 except Exception as e:
     logging.error(f"Critical app initialization error: {e}")
-    logging.error(f"Initialization traceback: {traceback.format_exc()}")
+    logging.error("Initialization traceback", exc_info=True)
     # Use the base app object as fallback
     app_instance = app
 
 # Ensure app is available at module level for Vercel imports
 if app_instance:
     app = app_instance
-    # Debug app instance for Vercel compatibility
-    logging.debug(f"Final app instance type: {type(app)}")
-    logging.debug(f"App instance is Flask app: {hasattr(app, 'wsgi_app')}")
-    logging.debug(f"App wsgi_app type: {type(getattr(app, 'wsgi_app', None))}")
-    
-    # Verify app is properly configured for WSGI
-    if hasattr(app, '__call__'):
-        logging.debug("App is callable (WSGI compatible)")
-    else:
+    if not callable(app):
         logging.error("CRITICAL: App is not callable - WSGI incompatible!")
-        
-    # Check if there are any proxy middleware issues
-    if hasattr(app, 'wsgi_app'):
-        logging.debug(f"WSGI app middleware stack: {type(app.wsgi_app)}")
-        wsgi_app = app.wsgi_app
-        # Walk the middleware stack
+
+    # Walk the middleware stack only when DEBUG output is actually emitted
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Final app instance type: %s", type(app))
+        current_wsgi = app.wsgi_app
         middleware_count = 0
-        current_wsgi = wsgi_app
         while hasattr(current_wsgi, 'app') and middleware_count < 10:
-            logging.debug(f"Middleware layer {middleware_count}: {type(current_wsgi)}")
-            current_wsgi = getattr(current_wsgi, 'app', current_wsgi)
+            logging.debug("Middleware layer %d: %s", middleware_count, type(current_wsgi))
+            current_wsgi = current_wsgi.app
             middleware_count += 1
@@ -1,31 +1,45 @@
 import os
 import logging
-import traceback
 
-# Configure basic logging for Vercel
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Root logging is configured once, by api.app, for the detected environment
 logger = logging.getLogger(__name__)
 
-# Set Vercel environment variables for proper detection
-os.environ['VERCEL'] = '1'
-os.environ['VERCEL_ENV'] = 'production'
+_HERE = os.path.dirname(os.path.abspath(__file__))
 
-# Enhanced logging for Vercel import process
-logging.info("Starting Vercel import process...")
+def _build_fallback(import_error):
+    """Minimal Flask app that reports why the real app failed to import"""
+    from flask import Flask, jsonify
+    fallback_app = Flask(__name__)
+    files_in_dir = os.listdir(_HERE)
+    details = str(import_error)
+    
+    @fallback_app.route('/')
+    def error_info():
+        return jsonify({
+            'error': 'App import failed in Vercel',
+            'details': details,
+            'current_dir': _HERE,
+            'files_in_dir': files_in_dir
+        }), 500
+    
+    @fallback_app.route('/debug')
+    def debug_info():
+        return jsonify({
+            'current_dir': _HERE,
+            'python_version': __import__('sys').version,
+            'environment_vars': {k: v for k, v in os.environ.items() if not k.startswith('_')},
+        })
+    
+    return fallback_app
 
 try:
-    from .app import app
-    logging.info("Flask app imported successfully in Vercel")
-    
-    # Debug app object for WSGI compatibility
-    logging.info(f"Flask app type: {type(app)}")
-    logging.debug(f"App callable: {callable(app)}")
-    logging.debug(f"App has wsgi_app: {hasattr(app, 'wsgi_app')}")
+    # Production-only entry: pins the Vercel environment before api.app loads
+    from ._vercel_app import app
+    logger.info("Flask app imported successfully in Vercel")
     
-    if hasattr(app, 'wsgi_app'):
-        logging.debug(f"WSGI app type: {type(app.wsgi_app)}")
-        
-        # Check the middleware stack for issues
+    # Middleware introspection is opt-in so the cold-start path stays minimal
+    if os.environ.get('VERCEL_DEBUG'):
+        logger.info("Flask app type: %s", type(app))
         wsgi_app = app.wsgi_app
         middleware_stack = []
         current = wsgi_app
@@ -35,64 +49,36 @@ try:
             current = getattr(current, 'app', current)
             depth += 1
         
-        logging.debug(f"Middleware stack: {' -> '.join(middleware_stack)}")
-        
-        # Verify the final WSGI app is callable
-        final_wsgi = current
-        logging.debug(f"Final WSGI layer: {type(final_wsgi)}")
-        logging.debug(f"Final WSGI callable: {callable(final_wsgi)}")
-        
-        # Check if there are any proxy issues that might cause issubclass errors
-        if hasattr(wsgi_app, '__class__'):
-            logging.debug(f"WSGI app class: {wsgi_app.__class__}")
-            logging.debug(f"WSGI app MRO: {wsgi_app.__class__.__mro__}")
-    
-    # Verify app is properly initialized
-    if not app:
-        raise ImportError("Flask app object is None after import")
+        logger.info("Middleware stack: %s", ' -> '.join(middleware_stack))
+        logger.info("Final WSGI layer: %s, callable: %s", type(current), callable(current))
+        logger.info("WSGI app MRO: %s", wsgi_app.__class__.__mro__)
     
     # Export the Flask app for Vercel Functions
     # For Flask on Vercel, only use 'app' - do NOT use 'handler'
     # 'handler' should only be used for BaseHTTPRequestHandler classes
     application = app
     
-    logging.info("WSGI application configured for Vercel")
+    # Run one-time setup during the init phase (which gets a CPU boost) rather
+    # than on the first request; failures are retried by the before_request hook
+    try:
+        from .app import boot_database
+        from .models import Settings
+        with app.app_context():
+            boot_database()
+            Settings.get_value('tax_fee_percentage')
+    except Exception as warm_error:
+        logger.warning("Init-phase warmup failed: %s", warm_error)
     
 except Exception as import_error:
-    logging.error(f"CRITICAL: Failed to import Flask app in Vercel: {import_error}")
-    logging.error(f"Import error traceback: {traceback.format_exc()}")
+    logger.error("CRITICAL: Failed to import Flask app in Vercel: %s", import_error)
+    logger.error("Import error traceback", exc_info=True)
     
     # Check if this is related to the issubclass error
     if 'issubclass' in str(import_error).lower():
-        logging.error("DETECTED: issubclass() error during Vercel app import!")
-    
-    # Fallback app for debugging
-    from flask import Flask, jsonify
-    fallback_app = Flask(__name__)
-    
-    @fallback_app.route('/')
-    def error_info():
-        return jsonify({
-            'error': 'App import failed in Vercel',
-            'details': str(import_error),
-            'current_dir': os.path.dirname(os.path.abspath(__file__)),
-            'files_in_dir': os.listdir(os.path.dirname(os.path.abspath(__file__)))
-        }), 500
-    
-    @fallback_app.route('/debug')
-    def debug_info():
-        return jsonify({
-            'current_dir': os.path.dirname(os.path.abspath(__file__)),
-            'python_version': __import__('sys').version,
-            'environment_vars': {k: v for k, v in os.environ.items() if not k.startswith('_')},
-        })
-    
-    # Export fallback app as proper WSGI callable for Vercel
-    def fallback_wsgi_handler(environ, start_response):
-        return fallback_app(environ, start_response)
+        logger.error("DETECTED: issubclass() error during Vercel app import!")
     
+    # Flask apps are WSGI callables already - export directly, no wrapper frame.
     # Do NOT use 'handler' for Flask apps - this causes the issubclass() error
-    application = fallback_wsgi_handler
-    app = fallback_wsgi_handler
+    application = app = _build_fallback(import_error)
     
-    logging.info("Fallback error app created for Vercel")
\ No newline at end of file
+    logger.info("Fallback error app created for Vercel")
\ No newline at end of file
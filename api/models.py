@@ -1,168 +1,205 @@
 import logging
-import traceback
-from datetime import datetime
-from .app import db
-from sqlalchemy import func
+from itertools import chain
+from .app import db, dialect_insert
+from .utils import get_cached_value, set_cached_value, clear_inventory_cache
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Exact decimal storage for money and rates; asdecimal=False keeps Python-side
+# arithmetic in floats so callers are unaffected
+MONEY = db.Numeric(18, 4, asdecimal=False)
+RATE = db.Numeric(18, 6, asdecimal=False)
+# Closed set of supported currencies, stored as a native PostgreSQL enum
+CURRENCY = db.Enum('CAD', 'IRR', 'USD', name='currency_enum')
 
 # Debug model imports
-logging.debug("Starting models.py import...")
-logging.debug(f"db instance in models.py: {db}")
-logging.debug(f"db.Model class: {db.Model}")
-logging.debug(f"db.Model type: {type(db.Model)}")
-
-logging.debug("Defining User model...")
-try:
-    class User(db.Model):
-        __tablename__ = 'user'
-        
-        id = db.Column(db.Integer, primary_key=True)
-        telegram_id = db.Column(db.BigInteger, unique=True, nullable=False)
-        first_name = db.Column(db.String(100), nullable=False)
-        last_name = db.Column(db.String(100))
-        username = db.Column(db.String(100))
-        photo_url = db.Column(db.Text)
-        is_whitelisted = db.Column(db.Boolean, default=False)
-        is_admin = db.Column(db.Boolean, default=False)
-        created_at = db.Column(db.DateTime, default=datetime.utcnow)
-        last_login = db.Column(db.DateTime)
-        
-        def __repr__(self):
-            return f'<User {self.telegram_id}: {self.first_name}>'
-        
-        @property
-        def full_name(self):
-            if self.last_name:
-                return f"{self.first_name} {self.last_name}"
-            return self.first_name
-
-    logging.debug("User model defined successfully")
-except Exception as user_model_error:
-    logging.error(f"CRITICAL: Failed to define User model: {user_model_error}")
-    logging.error(f"User model error traceback: {traceback.format_exc()}")
-    raise
-
-logging.debug("Defining Purchase model...")
-try:
-    class Purchase(db.Model):
-        __tablename__ = 'purchase'
-        id = db.Column(db.Integer, primary_key=True)
-        seller = db.Column(db.String(200), nullable=False)
-        date = db.Column(db.Date, nullable=False)
-        gold_amount = db.Column(db.Integer, nullable=False)  # WoW gold tokens (e.g., 50000 for 50k)
-        unit_price = db.Column(db.Float, nullable=False)   # price per 1000 gold tokens
-        currency = db.Column(db.String(3), nullable=False, default='CAD')  # CAD or IRR
-        total_cost = db.Column(db.Float, nullable=False)
-        cad_rate = db.Column(db.Float, nullable=True)  # CAD to local currency rate at purchase time
-        created_at = db.Column(db.DateTime, default=datetime.utcnow)
-        created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-        
-        # Relationship
-        creator = db.relationship('User', backref='purchases')
-        
-        def __repr__(self):
-            return f'<Purchase {self.id}: {self.gold_amount} gold @ {self.unit_price} {self.currency}/1k>'
-
-    logging.debug("Purchase model defined successfully")
-except Exception as purchase_model_error:
-    logging.error(f"CRITICAL: Failed to define Purchase model: {purchase_model_error}")
-    logging.error(f"Purchase model error traceback: {traceback.format_exc()}")
-    raise
-
-logging.debug("Defining Sale model...")
-try:
-    class Sale(db.Model):
-        __tablename__ = 'sale'
-        id = db.Column(db.Integer, primary_key=True)
-        gold_amount = db.Column(db.Integer, nullable=False)  # WoW gold tokens (e.g., 40000 for 40k)
-        unit_price = db.Column(db.Float, nullable=False)   # price per 1000 gold tokens in CAD
-        total_revenue = db.Column(db.Float, nullable=False)
-        date = db.Column(db.Date, nullable=False)
-        created_at = db.Column(db.DateTime, default=datetime.utcnow)
-        created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-        
-        # Relationship
-        creator = db.relationship('User', backref='sales')
-        
-        def __repr__(self):
-            return f'<Sale {self.id}: {self.gold_amount} gold @ {self.unit_price} CAD/1k>'
-
-    logging.debug("Sale model defined successfully")
-except Exception as sale_model_error:
-    logging.error(f"CRITICAL: Failed to define Sale model: {sale_model_error}")
-    logging.error(f"Sale model error traceback: {traceback.format_exc()}")
-    raise
-
-logging.debug("Defining ExchangeRate model...")
-try:
-    class ExchangeRate(db.Model):
-        __tablename__ = 'exchangerate'
-        id = db.Column(db.Integer, primary_key=True)
-        from_currency = db.Column(db.String(3), nullable=False)
-        to_currency = db.Column(db.String(3), nullable=False)
-        rate = db.Column(db.Float, nullable=False)
-        updated_at = db.Column(db.DateTime, default=datetime.utcnow)
-        
-        def __repr__(self):
-            return f'<ExchangeRate {self.from_currency}/{self.to_currency}: {self.rate}>'
-
-    logging.debug("ExchangeRate model defined successfully")
-except Exception as exchange_rate_model_error:
-    logging.error(f"CRITICAL: Failed to define ExchangeRate model: {exchange_rate_model_error}")
-    logging.error(f"ExchangeRate model error traceback: {traceback.format_exc()}")
-    raise
-
-logging.debug("Defining Settings model...")
-try:
-    class Settings(db.Model):
-        __tablename__ = 'settings'
-        id = db.Column(db.Integer, primary_key=True)
-        key = db.Column(db.String(100), unique=True, nullable=False)
-        value = db.Column(db.Text, nullable=False)
-        description = db.Column(db.Text)
-        updated_at = db.Column(db.DateTime, default=datetime.utcnow)
-        updated_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-        
-        # Relationship
-        updater = db.relationship('User', backref='settings_updates')
-        
-        def __repr__(self):
-            return f'<Settings {self.key}: {self.value}>'
-        
-        @classmethod
-        def get_value(cls, key, default=None):
-            """Helper method to get a setting value"""
-            setting = cls.query.filter_by(key=key).first()
-            return setting.value if setting else default
-        
-        @classmethod
-        def set_value(cls, key, value, description=None, user_id=None):
-            """Helper method to set a setting value"""
-            setting = cls.query.filter_by(key=key).first()
-            if setting:
-                setting.value = str(value)
-                setting.updated_at = datetime.utcnow()
-                if user_id:
-                    setting.updated_by = user_id
-                if description:
-                    setting.description = description
-            else:
-                setting = cls(
-                    key=key,
-                    value=str(value),
-                    description=description,
-                    updated_by=user_id or 1  # Default to first user if none provided
-                )
-                db.session.add(setting)
-            db.session.commit()
-            return setting
-
-    logging.debug("Settings model defined successfully")
-except Exception as settings_model_error:
-    logging.error(f"CRITICAL: Failed to define Settings model: {settings_model_error}")
-    logging.error(f"Settings model error traceback: {traceback.format_exc()}")
-    raise
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Starting models.py import...")
+    logger.debug("db instance in models.py: %s", db)
+    logger.debug("db.Model class: %s", db.Model)
+    logger.debug("db.Model type: %s", type(db.Model))
+
+
+class DateRangeMixin:
+    """Batched iteration over rows whose ``date`` falls within a range"""
+    
+    @classmethod
+    def stream_between(cls, start=None, end=None, batch_size=500):
+        """Yield rows newest first, fetching ``batch_size`` rows at a time"""
+        stmt = db.select(cls)
+        if start:
+            stmt = stmt.where(cls.date >= start)
+        if end:
+            stmt = stmt.where(cls.date <= end)
+        stmt = stmt.order_by(cls.created_at.desc()).execution_options(yield_per=batch_size)
+        return db.session.execute(stmt).scalars()
+
+
+class User(db.Model):
+    __tablename__ = 'user'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    telegram_id = db.Column(db.BigInteger, unique=True, nullable=False)
+    first_name = db.Column(db.String(100), nullable=False)
+    last_name = db.Column(db.String(100))
+    username = db.Column(db.String(100))
+    photo_url = db.Column(db.Text)
+    is_whitelisted = db.Column(db.Boolean, default=False)
+    is_admin = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, server_default=func.now())
+    last_login = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+    
+    @property
+    def full_name(self):
+        if self.last_name:
+            return f"{self.first_name} {self.last_name}"
+        return self.first_name
+
+
+class Purchase(DateRangeMixin, db.Model):
+    __tablename__ = 'purchase'
+    id = db.Column(db.Integer, primary_key=True)
+    seller = db.Column(db.String(200), nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    gold_amount = db.Column(db.Integer, nullable=False)  # WoW gold tokens (e.g., 50000 for 50k)
+    unit_price = db.Column(MONEY, nullable=False)   # price per 1000 gold tokens
+    currency = db.Column(CURRENCY, nullable=False, default='CAD')  # CAD or IRR
+    total_cost = db.Column(MONEY, nullable=False)
+    cad_rate = db.Column(RATE, nullable=True)  # CAD to local currency rate at purchase time
+    created_at = db.Column(db.DateTime, server_default=func.now(), index=True)  # newest-first listings
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    
+    # Relationship
+    creator = db.relationship('User', backref='purchases')
+    
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+
+
+class Sale(DateRangeMixin, db.Model):
+    __tablename__ = 'sale'
+    id = db.Column(db.Integer, primary_key=True)
+    gold_amount = db.Column(db.Integer, nullable=False)  # WoW gold tokens (e.g., 40000 for 40k)
+    unit_price = db.Column(MONEY, nullable=False)   # price per 1000 gold tokens in CAD
+    total_revenue = db.Column(MONEY, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, server_default=func.now(), index=True)  # newest-first listings
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    
+    # Relationship
+    creator = db.relationship('User', backref='sales')
+    
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+
+
+class ExchangeRate(db.Model):
+    __tablename__ = 'exchangerate'
+    __table_args__ = (
+        # One row per pair; the conflict target of the rate upsert
+        db.Index('uq_exchangerate_pair', 'from_currency', 'to_currency', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    from_currency = db.Column(CURRENCY, nullable=False)
+    to_currency = db.Column(CURRENCY, nullable=False)
+    rate = db.Column(RATE, nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+
+
+class Settings(db.Model):
+    __tablename__ = 'settings'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), unique=True, nullable=False)
+    value = db.Column(db.Text, nullable=False)
+    description = db.deferred(db.Column(db.Text))  # never read on request paths
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    
+    # Relationship
+    updater = db.relationship('User', backref='settings_updates')
+    
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+    
+    # Settings are read on hot paths but rarely written; the short TTL bounds
+    # staleness across workers that did not perform the write themselves
+    _CACHE_TTL_MINUTES = 0.5
+    
+    @classmethod
+    def get_value(cls, key, default=None):
+        """Helper method to get a setting value"""
+        # Cached as a 1-tuple so a missing setting is remembered too
+        cached = get_cached_value(f'setting:{key}', cls._CACHE_TTL_MINUTES)
+        if cached is None:
+            value = db.session.scalar(db.select(cls.value).where(cls.key == key))
+            cached = (value,)
+            set_cached_value(f'setting:{key}', cached, cls._CACHE_TTL_MINUTES)
+        return cached[0] if cached[0] is not None else default
+    
+    @classmethod
+    def set_value(cls, key, value, description=None, user_id=None):
+        """Helper method to set a setting value"""
+        cls.set_values({key: value}, description=description, user_id=user_id)
+    
+    @classmethod
+    def set_values(cls, values, description=None, user_id=None):
+        """Upsert several settings in a single INSERT ... ON CONFLICT round trip"""
+        rows = [
+            dict(key=key, value=str(value), description=description,
+                 updated_by=user_id or 1)  # Default to first user if none provided
+            for key, value in values.items()
+        ]
+        stmt = dialect_insert(cls.__table__).values(rows)
+        # onupdate does not apply to ON CONFLICT updates, so stamp updated_at here
+        changes = {'value': stmt.excluded.value, 'updated_at': func.now()}
+        if user_id:
+            changes['updated_by'] = stmt.excluded.updated_by
+        if description:
+            changes['description'] = stmt.excluded.description
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['key'], set_=changes))
+        db.session.commit()
+        for row in rows:
+            set_cached_value(f"setting:{row['key']}", (row['value'],), cls._CACHE_TTL_MINUTES)
+
+
+# Inventory stats cache invalidation. Any committed write to purchases or sales
+# - ORM flushes and ORM-enabled insert/update/delete statements alike - drops
+# this worker's cached stats at once; writes from other workers are still
+# caught by the data-version probe in calculate_inventory_and_profit().
+_INVENTORY_TABLES = frozenset({Purchase.__tablename__, Sale.__tablename__})
+
+@event.listens_for(Session, 'after_flush')
+def _flag_inventory_flush(session, flush_context):
+    if any(isinstance(obj, (Purchase, Sale))
+           for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['inventory_changed'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _flag_inventory_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name in _INVENTORY_TABLES:
+            orm_execute_state.session.info['inventory_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _clear_inventory_on_commit(session):
+    if session.info.pop('inventory_changed', False):
+        clear_inventory_cache()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_inventory_flag(session):
+    session.info.pop('inventory_changed', None)
 
 # Note: Relationships temporarily removed to resolve Vercel deployment issues
 # Can be added back once the core deployment issue is resolved
 
-logging.debug("All models defined successfully - models.py import complete")
\ No newline at end of file
+logger.debug("All models defined successfully - models.py import complete")
\ No newline at end of file
@@ -2,24 +2,42 @@ from flask import render_template, request, redirect, url_for, session, flash, j
 from datetime import datetime, date, timedelta
 import json
 import logging
-import traceback
+import sys
 from .app import app, db
 from .models import User, Purchase, Sale, ExchangeRate, Settings
-from .utils import get_exchange_rates, calculate_inventory_and_profit, convert_currency
+from .utils import (get_exchange_rates, calculate_inventory_and_profit, convert_currency,
+                    load_session_user, TransactionCreator)
 
 # Configure route logging
 logger = logging.getLogger(__name__)
 
+# Fixed for the life of the process (read from the environment at app import)
+BOT_OWNER_ID = app.config['BOT_OWNER_ID']
+
+def _skip_request_log(path):
+    """Static assets and health probes are too frequent to be worth logging"""
+    return path.startswith('/static/') or path == '/debug/health'
+
 # Add request logging middleware
 @app.before_request
 def log_request_info():
-    logger.info(f"Request: {request.method} {request.path} from {request.remote_addr}")
+    if not logger.isEnabledFor(logging.INFO) or _skip_request_log(request.path):
+        return
+    logger.info("Request: %s %s from %s", request.method, request.path, request.remote_addr)
     if request.method == 'POST':
-        logger.info(f"POST data keys: {list(request.form.keys()) if request.form else 'None'}")
+        logger.info("POST data keys: %s", list(request.form.keys()) if request.form else 'None')
+
+@app.before_request
+def backfill_owner_flag():
+    # Sessions issued before the flag existed are never re-authenticated, so
+    # derive it once from the stored Telegram id
+    if 'is_owner' not in session and 'telegram_id' in session:
+        session['is_owner'] = session['telegram_id'] == BOT_OWNER_ID
 
 @app.after_request
 def log_response_info(response):
-    logger.info(f"Response: {response.status_code} for {request.path}")
+    if logger.isEnabledFor(logging.INFO) and not _skip_request_log(request.path):
+        logger.info("Response: %s for %s", response.status_code, request.path)
     return response
 
 @app.route('/')
@@ -33,9 +51,9 @@ def login():
     # Check if user is already authenticated in session
     if 'user_id' in session and 'telegram_id' in session and 'cached_user_data' in session:
         # Quick session validation
-        user = User.query.get(session['user_id'])
+        user = load_session_user(session)
         if (user and user.telegram_id == session['telegram_id'] and 
-            (user.is_whitelisted or user.telegram_id == app.config.get('BOT_OWNER_ID'))):
+            (user.is_whitelisted or user.telegram_id == BOT_OWNER_ID)):
             logging.info(f"User {session['telegram_id']} already authenticated, redirecting to dashboard")
             return redirect(url_for('dashboard'))
     
@@ -52,14 +70,14 @@ def auth_status():
         # Enhanced session validation
         try:
             # Verify user still exists and is active
-            user = User.query.get(session['user_id'])
+            user = load_session_user(session)
             if not user or user.telegram_id != session['telegram_id']:
                 # Session is invalid, clear it
                 session.clear()
                 return jsonify({'authenticated': False, 'reason': 'Invalid session'})
             
             # Check if user is still whitelisted
-            if not user.is_whitelisted and user.telegram_id != app.config.get('BOT_OWNER_ID'):
+            if not user.is_whitelisted and user.telegram_id != BOT_OWNER_ID:
                 session.clear()
                 return jsonify({'authenticated': False, 'reason': 'Access revoked'})
             
@@ -83,7 +101,9 @@ def auth_status():
 def telegram_auth():
     """Handle Telegram WebApp authentication with cross-platform support and session caching"""
     try:
-        data = request.get_json()
+        # silent=True: malformed bodies become None and get the 400 below
+        # instead of raising into the generic 500 handler
+        data = request.get_json(silent=True)
         
         if not data or 'user' not in data:
             return jsonify({'error': 'Invalid authentication data'}), 400
@@ -133,14 +153,16 @@ def telegram_auth():
                 session['cached_user_data']['platform'] = platform_name
             
             # Verify cached session is still valid (user exists and is whitelisted)
-            cached_user = User.query.get(session['user_id'])
+            cached_user = load_session_user(session)
             if (cached_user and 
                 cached_user.telegram_id == telegram_id and 
-                (cached_user.is_whitelisted or cached_user.telegram_id == app.config.get('BOT_OWNER_ID'))):
+                (cached_user.is_whitelisted or cached_user.telegram_id == BOT_OWNER_ID)):
                 
                 # Update last login without full database operations
                 cached_user.last_login = datetime.utcnow()
                 db.session.commit()
+                # Backfill for sessions created before the claim existed
+                session['is_owner'] = cached_user.telegram_id == BOT_OWNER_ID
                 
                 logging.info(f"Using cached session for user {telegram_id} on {platform_name}")
                 return jsonify({'success': True, 'redirect': url_for('dashboard'), 'cached': True})
@@ -158,7 +180,7 @@ def telegram_auth():
             user.photo_url = user_data.get('photo_url', '')
             
             # Auto-whitelist and grant admin privileges to bot owner
-            if telegram_id == app.config.get('BOT_OWNER_ID'):
+            if telegram_id == BOT_OWNER_ID:
                 user.is_whitelisted = True
                 user.is_admin = True
                 logging.info(f"Auto-whitelisted bot owner: {telegram_id}")
@@ -175,7 +197,7 @@ def telegram_auth():
             user.photo_url = user_data.get('photo_url', user.photo_url)
             
             # Ensure bot owner always has admin privileges and is whitelisted
-            if telegram_id == app.config.get('BOT_OWNER_ID'):
+            if telegram_id == BOT_OWNER_ID:
                 if not user.is_whitelisted or not user.is_admin:
                     user.is_whitelisted = True
                     user.is_admin = True
@@ -185,13 +207,14 @@ def telegram_auth():
         db.session.commit()
         
         # Check if user is whitelisted
-        if not user.is_whitelisted and user.telegram_id != app.config.get('BOT_OWNER_ID'):
+        if not user.is_whitelisted and user.telegram_id != BOT_OWNER_ID:
             return jsonify({'error': 'Access denied. You are not authorized to use this application.'}), 403
         
         # Set session with cached user data and platform information
         session['user_id'] = user.id
         session['telegram_id'] = user.telegram_id
-        session['is_admin'] = user.is_admin or user.telegram_id == app.config.get('BOT_OWNER_ID')
+        session['is_owner'] = user.telegram_id == BOT_OWNER_ID
+        session['is_admin'] = user.is_admin or session['is_owner']
         session['platform_info'] = platform_info  # Store platform info for session consistency
         session['cached_user_data'] = {
             'first_name': user.first_name,
@@ -245,7 +268,7 @@ def auth_debug():
     
     if 'user_id' in session:
         try:
-            user = User.query.get(session['user_id'])
+            user = load_session_user(session)
             debug_info['database_user'] = {
                 'exists': user is not None,
                 'telegram_id': user.telegram_id if user else None,
@@ -280,9 +303,10 @@ def dashboard():
     # Calculate inventory and profit
     stats = calculate_inventory_and_profit()
     
-    # Get recent transactions (optimized with smaller limits for faster loading)
-    recent_purchases = Purchase.query.order_by(Purchase.created_at.desc()).limit(3).all()
-    recent_sales = Sale.query.order_by(Sale.created_at.desc()).limit(3).all()
+    # Get recent transactions (optimized with smaller limits for faster loading),
+    # both lists and their creators in a single query
+    from .utils import get_recent_transactions
+    recent_purchases, recent_sales = get_recent_transactions(3)
     
     return render_template('dashboard.html', 
                          user=user,
@@ -291,6 +315,16 @@ def dashboard():
                          recent_purchases=recent_purchases,
                          recent_sales=recent_sales)
 
+def _pos_float(name):
+    """Parse a required, strictly positive number from the submitted form"""
+    raw = request.form.get(name)
+    if not raw:
+        raise ValueError(f"{name} is required")
+    value = float(raw)
+    if not 0 < value < float('inf'):  # also rejects 'nan' and 'inf'
+        raise ValueError(f"{name} must be a positive number")
+    return value
+
 @app.route('/purchase', methods=['GET', 'POST'])
 def purchase():
     if 'user_id' not in session:
@@ -307,20 +341,16 @@ def purchase():
         try:
             seller = request.form.get('seller', '').strip()
             date_str = request.form.get('date')
-            gold_amount_k = float(request.form.get('gold_amount', 0))
+            gold_amount_k = _pos_float('gold_amount')
             gold_amount = int(gold_amount_k * 1000)  # Convert k format to actual WoW gold tokens
-            unit_price = float(request.form.get('unit_price', 0))  # Price per 1000 gold tokens
+            unit_price = _pos_float('unit_price')  # Price per 1000 gold tokens
             currency = request.form.get('currency', 'CAD')
             
-            if not all([seller, date_str, gold_amount_k > 0, unit_price > 0]):
+            if not (seller and date_str):
                 flash('All fields are required and amounts must be positive', 'error')
-                return render_template('purchase.html', user=user)
+                return redirect(url_for('purchase'))
             
-            if not date_str:
-                flash('Date is required', 'error')
-                return render_template('purchase.html', user=user)
-                
-            purchase_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            purchase_date = date.fromisoformat(date_str)
             total_cost = gold_amount_k * unit_price  # Calculate total cost based on k amount and price per 1k tokens
             
             # Get current CAD exchange rate for the purchase
@@ -340,22 +370,18 @@ def purchase():
                 # For CAD purchases, rate is 1.0
                 cad_rate = 1.0
             
-            purchase = Purchase()
-            purchase.seller = seller
-            purchase.date = purchase_date
-            purchase.gold_amount = gold_amount  # Store as total gold tokens
-            purchase.unit_price = unit_price  # Store as price per 1000 tokens
-            purchase.currency = currency
-            purchase.total_cost = total_cost
-            purchase.cad_rate = cad_rate  # Store CAD exchange rate at purchase time
-            purchase.created_by = user.id
-            
-            db.session.add(purchase)
-            db.session.commit()
-            
-            # Clear inventory cache since data changed
-            from .utils import clear_inventory_cache
-            clear_inventory_cache()
+            # Plain INSERT - nothing below needs the ORM object back
+            db.session.execute(db.insert(Purchase).values(
+                seller=seller,
+                date=purchase_date,
+                gold_amount=gold_amount,  # Store as total gold tokens
+                unit_price=unit_price,  # Store as price per 1000 tokens
+                currency=currency,
+                total_cost=total_cost,
+                cad_rate=cad_rate,  # Store CAD exchange rate at purchase time
+                created_by=user.id,
+            ))
+            db.session.commit()  # commit hook in models clears the inventory cache
             
             flash(f'Purchase recorded: {gold_amount_k}k WoW gold from {seller}', 'success')
             return redirect(url_for('dashboard'))
@@ -366,6 +392,8 @@ def purchase():
             logging.error(f"Purchase error: {e}")
             flash('Error recording purchase', 'error')
             db.session.rollback()
+        # Post/Redirect/Get: failed submissions land back on the plain form
+        return redirect(url_for('purchase'))
     
     return render_template('purchase.html', user=user, today=date.today().isoformat())
 
@@ -381,30 +409,27 @@ def sale():
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get current inventory
-    stats = calculate_inventory_and_profit()
-    available_inventory = stats['remaining_inventory']
+    # The page and the POST check only need the stock level, not the full
+    # FIFO cost/profit breakdown
+    from .utils import get_remaining_inventory
     
     if request.method == 'POST':
         try:
-            gold_amount_k = float(request.form.get('gold_amount', 0))
+            gold_amount_k = _pos_float('gold_amount')
             gold_amount = int(gold_amount_k * 1000)  # Convert k format to actual WoW gold tokens
-            unit_price = float(request.form.get('unit_price', 0))  # Price per 1000 gold tokens
+            unit_price = _pos_float('unit_price')  # Price per 1000 gold tokens
             date_str = request.form.get('date')
             
-            if not all([gold_amount_k > 0, unit_price > 0, date_str]):
+            if not date_str:
                 flash('All fields are required and amounts must be positive', 'error')
-                return render_template('sale.html', user=user, available_inventory=available_inventory, today=date.today().isoformat())
+                return redirect(url_for('sale'))
             
+            available_inventory = get_remaining_inventory()
             if gold_amount > available_inventory:
                 flash(f'Cannot sell {gold_amount_k}k WoW gold. Only {available_inventory/1000:.1f}k available.', 'error')
-                return render_template('sale.html', user=user, available_inventory=available_inventory, today=date.today().isoformat())
+                return redirect(url_for('sale'))
             
-            if not date_str:
-                flash('Date is required', 'error')
-                return render_template('sale.html', user=user, available_inventory=available_inventory, today=date.today().isoformat())
-                
-            sale_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            sale_date = date.fromisoformat(date_str)
             gross_revenue = gold_amount_k * unit_price  # Calculate gross revenue based on k amount and price per 1k tokens
             
             # Apply tax/fee deduction
@@ -413,19 +438,15 @@ def sale():
             tax_fee_amount = gross_revenue * (tax_fee_percentage / 100)
             net_revenue = gross_revenue - tax_fee_amount
             
-            sale = Sale()
-            sale.gold_amount = gold_amount  # Store as total gold tokens
-            sale.unit_price = unit_price  # Store as price per 1000 tokens
-            sale.total_revenue = net_revenue  # Store net revenue after tax/fee deduction
-            sale.date = sale_date
-            sale.created_by = user.id
-            
-            db.session.add(sale)
-            db.session.commit()
-            
-            # Clear inventory cache since data changed
-            from .utils import clear_inventory_cache
-            clear_inventory_cache()
+            # Plain INSERT - nothing below needs the ORM object back
+            db.session.execute(db.insert(Sale).values(
+                gold_amount=gold_amount,  # Store as total gold tokens
+                unit_price=unit_price,  # Store as price per 1000 tokens
+                total_revenue=net_revenue,  # Store net revenue after tax/fee deduction
+                date=sale_date,
+                created_by=user.id,
+            ))
+            db.session.commit()  # commit hook in models clears the inventory cache
             
             flash(f'Sale recorded: {gold_amount_k}k WoW gold for ${net_revenue:.2f} CAD (net after {tax_fee_percentage}% tax/fees)', 'success')
             return redirect(url_for('dashboard'))
@@ -436,6 +457,10 @@ def sale():
             logging.error(f"Sale error: {e}")
             flash('Error recording sale', 'error')
             db.session.rollback()
+        # Post/Redirect/Get: failed submissions land back on the plain form
+        return redirect(url_for('sale'))
+    
+    available_inventory = get_remaining_inventory()
     
     # Get current tax/fee percentage setting for frontend calculation
     tax_fee_setting = Settings.get_value('tax_fee_percentage', '0')
@@ -443,54 +468,102 @@ def sale():
     
     return render_template('sale.html', user=user, available_inventory=available_inventory, today=date.today().isoformat(), tax_fee_percentage=tax_fee_percentage)
 
+_ADMIN_PAGE_SIZE = 50
+
 @app.route('/admin')
 def admin():
     # Only allow actual bot owner to access admin panel
-    if 'telegram_id' not in session or session.get('telegram_id') != app.config['BOT_OWNER_ID']:
+    if not session.get('is_owner'):
         flash('Bot owner access required', 'error')
         return redirect(url_for('dashboard'))
     
     # Get current user (using cache for performance)
     from .utils import get_user_from_session
     user = get_user_from_session(session)
-    users = User.query.all()
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    # One page of users with their transaction counts as correlated subqueries,
+    # instead of every user plus a lazy load of all their purchases and sales
+    purchase_count = (db.select(db.func.count(Purchase.id))
+                      .where(Purchase.created_by == User.id).scalar_subquery())
+    sale_count = (db.select(db.func.count(Sale.id))
+                  .where(Sale.created_by == User.id).scalar_subquery())
+    rows = db.session.execute(
+        db.select(User, purchase_count, sale_count).order_by(User.id)
+        .limit(_ADMIN_PAGE_SIZE + 1).offset((page - 1) * _ADMIN_PAGE_SIZE)
+    ).all()
+    has_next = len(rows) > _ADMIN_PAGE_SIZE
+    rows = rows[:_ADMIN_PAGE_SIZE]
+    users = [row[0] for row in rows]
+    transaction_counts = {row[0].id: (row[1], row[2]) for row in rows}
+    
+    # Summary cards cover all users, not just the current page
+    total_users, whitelisted_users = _count_rows(
+        db.select(db.func.count(User.id)),
+        db.select(db.func.count(User.id)).where(User.is_whitelisted.is_(True)),
+    )
     
     # Get current tax/fee percentage setting
     tax_fee_setting = Settings.get_value('tax_fee_percentage', '0')
     tax_fee_percentage = float(tax_fee_setting) if tax_fee_setting else 0.0
     
-    return render_template('admin.html', user=user, users=users, tax_fee_percentage=tax_fee_percentage)
+    return render_template('admin.html', user=user, users=users, tax_fee_percentage=tax_fee_percentage,
+                           transaction_counts=transaction_counts, page=page, has_next=has_next,
+                           total_users=total_users, whitelisted_users=whitelisted_users)
 
 @app.route('/admin/whitelist/<int:user_id>/<action>')
 def toggle_whitelist(user_id, action):
     # Only allow actual bot owner to modify whitelist
-    if 'telegram_id' not in session or session.get('telegram_id') != app.config['BOT_OWNER_ID']:
+    if not session.get('is_owner'):
         flash('Bot owner access required', 'error')
         return redirect(url_for('dashboard'))
     
-    target_user = User.query.get(user_id)
-    if not target_user:
-        flash('User not found', 'error')
+    if action not in ('add', 'remove'):
         return redirect(url_for('admin'))
     
-    if action == 'add':
-        target_user.is_whitelisted = True
-        flash(f'{target_user.full_name} added to whitelist', 'success')
-    elif action == 'remove':
-        if target_user.telegram_id == app.config['BOT_OWNER_ID']:
-            flash('Cannot remove bot owner from whitelist', 'error')
-        else:
-            target_user.is_whitelisted = False
-            flash(f'{target_user.full_name} removed from whitelist', 'success')
-    
+    # One UPDATE instead of load-then-set; the owner guard lives in the WHERE
+    # clause so it is enforced atomically with the write
+    stmt = db.update(User).where(User.id == user_id).values(is_whitelisted=(action == 'add'))
+    if action == 'remove':
+        stmt = stmt.where(User.telegram_id != BOT_OWNER_ID)
+    names = (User.first_name, User.last_name, User.photo_url)
+    if db.engine.dialect.update_returning:
+        row = db.session.execute(stmt.returning(*names)).first()
+    else:
+        updated = db.session.execute(stmt).rowcount
+        row = updated and db.session.execute(db.select(*names).where(User.id == user_id)).first()
     db.session.commit()
+    
+    if row:
+        target_name = TransactionCreator(*row).full_name
+        verb = 'added to' if action == 'add' else 'removed from'
+        flash(f'{target_name} {verb} whitelist', 'success')
+    elif action == 'remove' and db.session.get(User, user_id):
+        flash('Cannot remove bot owner from whitelist', 'error')
+    else:
+        flash('User not found', 'error')
     return redirect(url_for('admin'))
 
+def _count_rows(*queries):
+    """Row counts for several count() selects in a single round trip"""
+    return db.session.execute(db.select(*(query.scalar_subquery() for query in queries))).one()
+
+def _clear_tables(*models):
+    """Empty whole tables - TRUNCATE on PostgreSQL, plain DELETE elsewhere"""
+    if db.engine.dialect.name == 'postgresql':
+        tables = ', '.join(f'"{model.__tablename__}"' for model in models)
+        # Sequences keep counting so ids are never reused; the inventory data
+        # version in other workers' caches relies on that
+        db.session.execute(db.text(f"TRUNCATE TABLE {tables}"))
+    else:
+        for model in models:
+            db.session.execute(db.delete(model))
+
 @app.route('/admin/reset-database', methods=['POST'])
 def reset_database():
     """Bot owner only - Reset/clear all database data while preserving structure"""
     # Only allow actual bot owner to reset database
-    if 'telegram_id' not in session or session.get('telegram_id') != app.config['BOT_OWNER_ID']:
+    if not session.get('is_owner'):
         flash('Bot owner access required', 'error')
         return redirect(url_for('dashboard'))
     
@@ -504,25 +577,28 @@ def reset_database():
         from .models import Purchase, Sale, ExchangeRate, User, Settings
         
         # Count records for logging
-        purchases_count = Purchase.query.count()
-        sales_count = Sale.query.count()
-        exchange_rates_count = ExchangeRate.query.count()
-        users_count = User.query.filter(User.telegram_id != app.config['BOT_OWNER_ID']).count()
-        settings_count = Settings.query.count()
+        purchases_count, sales_count, exchange_rates_count, users_count, settings_count = _count_rows(
+            db.select(db.func.count(Purchase.id)),
+            db.select(db.func.count(Sale.id)),
+            db.select(db.func.count(ExchangeRate.id)),
+            db.select(db.func.count(User.id)).where(User.telegram_id != BOT_OWNER_ID),
+            db.select(db.func.count(Settings.id)),
+        )
         
-        # Delete all transaction data
-        Purchase.query.delete()
-        Sale.query.delete()
-        ExchangeRate.query.delete()
+        # Delete all transaction data and settings (complete reset); settings
+        # and purchases/sales reference users, so they go first
+        _clear_tables(Purchase, Sale, ExchangeRate, Settings)
         
         # Delete all users except the bot owner
-        User.query.filter(User.telegram_id != app.config['BOT_OWNER_ID']).delete()
-        
-        # Delete all settings (complete reset)
-        Settings.query.delete()
+        User.query.filter(User.telegram_id != BOT_OWNER_ID).delete()
         
         db.session.commit()
         
+        from .utils import clear_inventory_cache, clear_settings_cache, clear_rate_map
+        clear_inventory_cache()
+        clear_settings_cache()
+        clear_rate_map()
+        
         logging.info(f"Full database reset performed by bot owner: {session.get('telegram_id')} - Deleted {purchases_count} purchases, {sales_count} sales, {exchange_rates_count} exchange rates, {users_count} users, {settings_count} settings")
         flash(f'Database completely reset. Deleted {purchases_count} purchases, {sales_count} sales, {exchange_rates_count} exchange rates, {users_count} users, and {settings_count} settings. Only bot owner account preserved.', 'success')
         
@@ -537,7 +613,7 @@ def reset_database():
 def reset_transactions():
     """Bot owner only - Reset/clear only transaction data (purchases, sales) while keeping users"""
     # Only allow actual bot owner to reset transactions
-    if 'telegram_id' not in session or session.get('telegram_id') != app.config['BOT_OWNER_ID']:
+    if not session.get('is_owner'):
         flash('Bot owner access required', 'error')
         return redirect(url_for('dashboard'))
     
@@ -551,16 +627,20 @@ def reset_transactions():
         from .models import Purchase, Sale, ExchangeRate
         
         # Delete all purchases and sales only (preserve users and settings)
-        purchases_count = Purchase.query.count()
-        sales_count = Sale.query.count()
-        exchange_rates_count = ExchangeRate.query.count()
+        purchases_count, sales_count, exchange_rates_count = _count_rows(
+            db.select(db.func.count(Purchase.id)),
+            db.select(db.func.count(Sale.id)),
+            db.select(db.func.count(ExchangeRate.id)),
+        )
         
-        Purchase.query.delete()
-        Sale.query.delete()
-        ExchangeRate.query.delete()
+        _clear_tables(Purchase, Sale, ExchangeRate)
         
         db.session.commit()
         
+        from .utils import clear_inventory_cache, clear_rate_map
+        clear_inventory_cache()
+        clear_rate_map()
+        
         logging.info(f"Transaction reset performed by bot owner: {session.get('telegram_id')} - Deleted {purchases_count} purchases, {sales_count} sales, {exchange_rates_count} exchange rates")
         flash(f'Transactions successfully reset. Deleted {purchases_count} purchases, {sales_count} sales, and {exchange_rates_count} exchange rates. All users and system settings preserved.', 'success')
         
@@ -575,7 +655,7 @@ def reset_transactions():
 def update_settings():
     """Bot owner only - Update system configuration settings"""
     # Only allow actual bot owner to update settings
-    if 'telegram_id' not in session or session.get('telegram_id') != app.config['BOT_OWNER_ID']:
+    if not session.get('is_owner'):
         flash('Bot owner access required', 'error')
         return redirect(url_for('dashboard'))
     
@@ -628,33 +708,26 @@ def history():
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    # Base queries
-    purchases_query = Purchase.query
-    sales_query = Sale.query
-    
     # Apply date filters if provided
+    date_from_obj = None
     if date_from:
         try:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-            purchases_query = purchases_query.filter(Purchase.date >= date_from_obj)
-            sales_query = sales_query.filter(Sale.date >= date_from_obj)
+            date_from_obj = date.fromisoformat(date_from)
         except ValueError:
             pass
     
+    date_to_obj = None
     if date_to:
         try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-            purchases_query = purchases_query.filter(Purchase.date <= date_to_obj)
-            sales_query = sales_query.filter(Sale.date <= date_to_obj)
+            date_to_obj = date.fromisoformat(date_to)
         except ValueError:
             pass
     
-    # Get transactions based on filter
+    # Get transactions based on filter, streaming rows in batches
     transactions = []
     
     if transaction_type in ['all', 'purchase']:
-        purchases = purchases_query.order_by(Purchase.created_at.desc()).all()
-        for purchase in purchases:
+        for purchase in Purchase.stream_between(date_from_obj, date_to_obj):
             transactions.append({
                 'type': 'purchase',
                 'id': purchase.id,
@@ -669,8 +742,7 @@ def history():
             })
     
     if transaction_type in ['all', 'sale']:
-        sales = sales_query.order_by(Sale.created_at.desc()).all()
-        for sale in sales:
+        for sale in Sale.stream_between(date_from_obj, date_to_obj):
             transactions.append({
                 'type': 'sale',
                 'id': sale.id,
@@ -713,7 +785,9 @@ def history():
 @app.route('/api/exchange-rates')
 def api_exchange_rates():
     """API endpoint for live exchange rates"""
-    rates = get_exchange_rates()
+    # ?refresh=1 bypasses the rate cache, for the bot owner only
+    force = request.args.get('refresh') == '1' and bool(session.get('is_owner'))
+    rates = get_exchange_rates(force=force)
     return jsonify(rates)
 
 @app.errorhandler(404)
@@ -723,42 +797,44 @@ def not_found(error):
 
 @app.errorhandler(500)
 def server_error(error):
-    logger.error(f"500 Error: {str(error)}")
-    logger.error(f"500 Error traceback: {traceback.format_exc()}")
+    logger.error("500 Error: %s", error, exc_info=True)
     return render_template('500.html'), 500
 
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Handle all unhandled exceptions"""
-    logger.error(f"Unhandled exception: {str(e)}")
-    logger.error(f"Exception traceback: {traceback.format_exc()}")
+    logger.error("Unhandled exception: %s", e, exc_info=True)
     
     # For AJAX requests, return JSON error
-    if request.is_json or 'application/json' in request.headers.get('Content-Type', ''):
+    # is_json covers JSON request bodies; Accept covers fetch() calls posting forms
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        message = str(e) if app.debug else 'An error occurred'
         return jsonify({
             'error': 'Internal server error',
-            'message': str(e) if app.debug else 'An error occurred'
+            'message': message
         }), 500
     
     # For regular requests, return error page
     return render_template('500.html'), 500
 
+# Health check fields that cannot change for the life of the process
+_HEALTH_STATIC = {
+    'environment': 'production' if app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('postgresql') else 'development',
+    'python_version': '.'.join(map(str, sys.version_info[:3])),
+    'config_keys': list(app.config.keys())[:10]  # First 10 config keys
+}
+_PING = db.text("SELECT 1")
+
 # Debug route for Vercel
 @app.route('/debug/health')
 def health_check():
     """Health check endpoint for debugging"""
     try:
         # Test database connection
-        result = db.session.execute(db.text("SELECT 1")).scalar()
+        result = db.session.execute(_PING).scalar()
         db_status = "OK" if result == 1 else "FAILED"
         
-        return jsonify({
-            'status': 'OK',
-            'database': db_status,
-            'environment': 'production' if app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('postgresql') else 'development',
-            'python_version': f"{__import__('sys').version_info.major}.{__import__('sys').version_info.minor}.{__import__('sys').version_info.micro}",
-            'config_keys': list(app.config.keys())[:10]  # First 10 config keys
-        })
+        return jsonify({'status': 'OK', 'database': db_status, **_HEALTH_STATIC})
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return jsonify({
@@ -1,7 +1,39 @@
 import requests
+import json
 import logging
+import re
+from collections import namedtuple
 from datetime import datetime, timedelta
+from functools import lru_cache
+from types import SimpleNamespace
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP session for rate lookups - keeps TLS connections to tgju.org and
+# the FX APIs alive between calls instead of handshaking on every request
+_HTTP = requests.Session()
+_HTTP.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9,fa;q=0.8'
+})
+# (connect, read) seconds: an unreachable host fails fast and lets the
+# fallback sources run, while a slow but live one still gets time to answer
+_HTTP_TIMEOUT = (3, 7)
+# Per-request override for the JSON APIs; requests merges it over the session's
+# browser-style defaults
+_JSON_HEADERS = {'Accept': 'application/json'}
+# Also retry throttling and gateway errors; after the last attempt the response
+# is handed back (raise_on_status=False) for the callers' own status checks
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                            max_retries=Retry(total=2, backoff_factor=0.2,
+                                              status_forcelist=(429, 502, 503, 504),
+                                              raise_on_status=False))
+_HTTP.mount('http://', _HTTP_ADAPTER)
+_HTTP.mount('https://', _HTTP_ADAPTER)
 
 # Cache storage with TTL
 _cache = {}
@@ -10,40 +42,58 @@ _cache_ttl = {}
 def get_cached_value(key, ttl_minutes=10):
     """Get cached value if still valid"""
     if key in _cache and key in _cache_ttl:
-        if time.time() < _cache_ttl[key]:
+        if time.monotonic() < _cache_ttl[key]:
             return _cache[key]
     return None
 
 def set_cached_value(key, value, ttl_minutes=10):
     """Set cached value with TTL"""
     _cache[key] = value
-    _cache_ttl[key] = time.time() + (ttl_minutes * 60)
+    _cache_ttl[key] = time.monotonic() + (ttl_minutes * 60)
+
+# Whole-thousand amounts up to 100k make up most rendered rows
+_GOLD_K_LABELS = {0: "0", **{i * 1000: f"{i}k" for i in range(1, 101)}}
 
 def format_gold_quantity(amount):
     """Format gold quantity in k format (1k, 2k, 1.5k, etc.)"""
+    # Fast path: gold amounts are stored as integer token counts
+    if type(amount) is int:
+        label = _GOLD_K_LABELS.get(amount)
+        if label is not None:
+            return label
+        if amount < 1000:
+            return str(amount)
+        thousands, rest = divmod(amount, 1000)
+        return f"{thousands}k" if not rest else f"{amount / 1000:.1f}k"
+    
     try:
         if amount is None:
             return "0"
-        
-        amount = float(amount)
-        if amount == 0:
-            return "0"
-        elif amount >= 1000:
-            # Convert to k format
-            k_amount = amount / 1000
-            if k_amount == int(k_amount):
-                return f"{int(k_amount)}k"
-            else:
-                return f"{k_amount:.1f}k"
-        else:
-            # For amounts less than 1000, show with decimal if needed
-            if amount == int(amount):
-                return str(int(amount))
-            else:
-                return f"{amount:.1f}"
+        return _format_gold_float(float(amount))
     except (ValueError, TypeError):
         return "0"
 
+@lru_cache(maxsize=1024)
+def _format_gold_float(amount):
+    """k-format a float gold amount; pages repeat the same few values, so cache"""
+    if amount == 0:
+        return "0"
+    elif amount >= 1000:
+        # Convert to k format
+        k_amount = amount / 1000
+        whole = int(k_amount)
+        if k_amount == whole:
+            return f"{whole}k"
+        else:
+            return f"{k_amount:.1f}k"
+    else:
+        # For amounts less than 1000, show with decimal if needed
+        whole = int(amount)
+        if amount == whole:
+            return str(whole)
+        else:
+            return f"{amount:.1f}"
+
 def format_currency(amount, currency='CAD'):
     """Format currency amount with proper currency symbol"""
     try:
@@ -70,220 +120,231 @@ def format_currency(amount, currency='CAD'):
     except (ValueError, TypeError):
         return f"0 {currency}"
 
-def get_exchange_rates():
-    """Fetch live exchange rates from tgju.org - all rates fetched directly, no hardcoded values"""
-    # Check cache first (cache for 15 minutes to avoid repeated API calls)
-    cached_rates = get_cached_value('exchange_rates', 15)
-    if cached_rates:
-        logging.debug("Using cached exchange rates")
-        return cached_rates
-    
-    logging.debug("Fetching fresh exchange rates from tgju.org")
-    
-    # Late imports to avoid circular dependency
-    from .models import ExchangeRate
-    from .app import db
-    
+def _run_fetchers(fetchers):
+    """Run independent rate fetchers concurrently, merging results in list order"""
     rates = {}
-    import re
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.9,fa;q=0.8'
-    }
-    
-    # STEP 1: Fetch USD to IRR rate directly from tgju.org
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as pool:
+        for partial in pool.map(lambda fetch: fetch(), fetchers):
+            rates.update(partial)
+    return rates
+
+# tgju.org page patterns, compiled once. Every pattern contains its page's
+# marker word, so matching starts at the marker's first occurrence rather
+# than scanning the whole document from the top.
+_TGJU_RATE_MARKER = 'نرخ فعلی'  # "Current Rate" label in the profile table
+_TGJU_RATE_RES = [
+    # Look for: نرخ فعلی | 1,191,550
+    re.compile(r'نرخ فعلی\s*\|\s*([0-9,]+)', re.DOTALL),
+    re.compile(r'نرخ فعلی[^0-9]*([0-9]{1,3}(?:,[0-9]{3})+)', re.DOTALL),
+    re.compile(r'>نرخ فعلی<[^>]*>[^>]*>([0-9,]+)<', re.DOTALL),
+]
+_TGJU_RATE_WINDOW = 500  # the rate cell sits right after its label
+_TGJU_USD_MARKER = 'دلار'  # "Dollar" on the main page
+_TGJU_MAIN_USD_RES = [
+    re.compile(r'دلار[^<]*</[^>]*>\s*<[^>]*>([0-9,]+)', re.DOTALL),
+    re.compile(r'>دلار<.*?>([0-9]{1,3}(?:,[0-9]{3})+)<', re.DOTALL),
+]
+
+# tgju.org pages are large; read only up to a window past the first marker
+_PAGE_MAX_BYTES = 1_000_000
+_PAGE_TAIL_BYTES = 64 * 1024
+
+def _read_page(url, marker, timeout=_HTTP_TIMEOUT):
+    """Body of ``url`` up to ``_PAGE_TAIL_BYTES`` past ``marker`` (None on HTTP errors)"""
+    marker_bytes = marker.encode('utf-8')
+    with _HTTP.get(url, timeout=timeout, stream=True) as response:
+        if not response.ok:
+            logging.warning(f"{url} returned HTTP {response.status_code}")
+            return None
+        body = bytearray()
+        stop_at = _PAGE_MAX_BYTES
+        for chunk in response.iter_content(chunk_size=16384):
+            scan_from = max(len(body) - len(marker_bytes), 0)
+            body += chunk
+            if stop_at == _PAGE_MAX_BYTES:
+                found = body.find(marker_bytes, scan_from)
+                if found >= 0:
+                    stop_at = min(found + _PAGE_TAIL_BYTES, _PAGE_MAX_BYTES)
+            if len(body) >= stop_at:
+                break
+        # A cut can split a multi-byte character; replace it rather than fail
+        return body[:stop_at].decode(response.encoding or 'utf-8', errors='replace')
+
+def _parse_tgju_profile_rate(text, low, high):
+    """Current-rate cell of a tgju.org profile page, if it falls in [low, high]"""
+    # Cheap substring search first; the patterns then only run on a short
+    # window after each occurrence of the label instead of the rest of the page
+    start = text.find(_TGJU_RATE_MARKER)
+    while start >= 0:
+        window = text[max(start - 1, 0):start + _TGJU_RATE_WINDOW]
+        for pattern in _TGJU_RATE_RES:
+            match = pattern.search(window)
+            if match:
+                clean_rate = match.group(1).replace(',', '').strip()
+                if clean_rate.isdigit():
+                    test_rate = float(clean_rate)
+                    if low <= test_rate <= high:
+                        return test_rate
+        start = text.find(_TGJU_RATE_MARKER, start + 1)
+    return None
+
+def _fetch_tgju_usd():
+    """STEP 1: USD to IRR rate directly from the tgju.org profile page"""
     try:
-        usd_profile_url = "https://www.tgju.org/profile/price_dollar_rl"
-        usd_response = requests.get(usd_profile_url, headers=headers, timeout=15)
-        if usd_response.status_code == 200:
-            usd_text = usd_response.text
-            usd_rate = None
-            
-            # Pattern to find "نرخ فعلی" (Current Rate) in the table
-            # Look for: نرخ فعلی | 1,191,550
-            rate_patterns = [
-                r'نرخ فعلی\s*\|\s*([0-9,]+)',
-                r'نرخ فعلی[^0-9]*([0-9]{1,3}(?:,[0-9]{3})+)',
-                r'>نرخ فعلی<[^>]*>[^>]*>([0-9,]+)<',
-            ]
-            
-            for pattern in rate_patterns:
-                matches = re.findall(pattern, usd_text, re.DOTALL)
-                if matches:
-                    for match_str in matches:
-                        clean_rate = match_str.replace(',', '').strip()
-                        if clean_rate.isdigit():
-                            test_rate = float(clean_rate)
-                            # USD to IRR should be in range 500,000 - 2,000,000 (realistic range)
-                            if 500000 <= test_rate <= 2000000:
-                                usd_rate = test_rate
-                                logging.info(f"Found USD to IRR rate from TGJU profile: {usd_rate}")
-                                break
-                if usd_rate:
-                    break
-            
+        usd_text = _read_page("https://www.tgju.org/profile/price_dollar_rl", _TGJU_RATE_MARKER)
+        if usd_text is not None:
+            # USD to IRR should be in range 500,000 - 2,000,000 (realistic range)
+            usd_rate = _parse_tgju_profile_rate(usd_text, 500000, 2000000)
             if usd_rate:
-                rates['USD_to_IRR'] = usd_rate
                 logging.info(f"Got USD to IRR rate from tgju.org: {usd_rate} IRR/USD")
-            else:
-                logging.warning("Could not parse USD rate from TGJU profile page")
+                return {'USD_to_IRR': usd_rate}
+            logging.warning("Could not parse USD rate from TGJU profile page")
     except Exception as e:
         logging.warning(f"Failed to get USD rate from TGJU: {e}")
-    
-    # STEP 2: Fetch CAD to IRR rate directly from tgju.org (NOT calculated from USD)
+    return {}
+
+def _fetch_tgju_cad():
+    """STEP 2: CAD to IRR rate directly from tgju.org (NOT calculated from USD)"""
     try:
-        cad_profile_url = "https://www.tgju.org/profile/price_cad"
-        cad_response = requests.get(cad_profile_url, headers=headers, timeout=15)
-        if cad_response.status_code == 200:
-            cad_text = cad_response.text
-            cad_rate = None
-            
-            # Pattern to find "نرخ فعلی" (Current Rate) in the table
-            # Look for: نرخ فعلی | 852,600
-            rate_patterns = [
-                r'نرخ فعلی\s*\|\s*([0-9,]+)',
-                r'نرخ فعلی[^0-9]*([0-9]{1,3}(?:,[0-9]{3})+)',
-                r'>نرخ فعلی<[^>]*>[^>]*>([0-9,]+)<',
-            ]
-            
-            for pattern in rate_patterns:
-                matches = re.findall(pattern, cad_text, re.DOTALL)
-                if matches:
-                    for match_str in matches:
-                        clean_rate = match_str.replace(',', '').strip()
-                        if clean_rate.isdigit():
-                            test_rate = float(clean_rate)
-                            # CAD to IRR should be in range 400,000 - 1,500,000 (realistic range)
-                            if 400000 <= test_rate <= 1500000:
-                                cad_rate = test_rate
-                                logging.info(f"Found CAD to IRR rate from TGJU profile: {cad_rate}")
-                                break
-                if cad_rate:
-                    break
-            
+        cad_text = _read_page("https://www.tgju.org/profile/price_cad", _TGJU_RATE_MARKER)
+        if cad_text is not None:
+            # CAD to IRR should be in range 400,000 - 1,500,000 (realistic range)
+            cad_rate = _parse_tgju_profile_rate(cad_text, 400000, 1500000)
             if cad_rate:
-                rates['IRR'] = cad_rate
                 logging.info(f"Got CAD to IRR rate from tgju.org: {cad_rate} IRR/CAD")
-            else:
-                logging.warning("Could not parse CAD rate from TGJU profile page")
+                return {'IRR': cad_rate}
+            logging.warning("Could not parse CAD rate from TGJU profile page")
     except Exception as e:
         logging.warning(f"Failed to get CAD rate from TGJU: {e}")
-    
-    # STEP 3: If TGJU profile pages failed, try the main page
-    if 'USD_to_IRR' not in rates or 'IRR' not in rates:
-        try:
-            tgju_url = "https://www.tgju.org"
-            response = requests.get(tgju_url, headers=headers, timeout=15)
-            if response.status_code == 200:
-                response_text = response.text
-                
-                # Try to find USD rate (دلار) if not already found
-                if 'USD_to_IRR' not in rates:
-                    usd_patterns = [
-                        r'دلار[^<]*</[^>]*>\s*<[^>]*>([0-9,]+)',
-                        r'>دلار<.*?>([0-9]{1,3}(?:,[0-9]{3})+)<',
-                    ]
-                    for pattern in usd_patterns:
-                        matches = re.findall(pattern, response_text, re.DOTALL)
-                        if matches:
-                            for match_str in matches:
-                                clean_rate = match_str.replace(',', '')
-                                if clean_rate.isdigit():
-                                    test_rate = float(clean_rate)
-                                    if 500000 <= test_rate <= 2000000:
-                                        rates['USD_to_IRR'] = test_rate
-                                        logging.info(f"Found USD to IRR rate from TGJU main page: {test_rate}")
-                                        break
-                        if 'USD_to_IRR' in rates:
-                            break
-        except Exception as e:
-            logging.warning(f"Failed to get rates from TGJU main page: {e}")
-    
-    # STEP 4: Get CAD to USD rate from reliable sources for cross-conversions
+    return {}
+
+def _fetch_tgju_main_usd():
+    """STEP 3: USD to IRR rate from the tgju.org main page, if the profile page failed"""
     try:
-        response = requests.get("https://www.bankofcanada.ca/valet/observations/FXUSDCAD/json?recent=1", timeout=10)
+        text = _read_page("https://www.tgju.org", _TGJU_USD_MARKER)
+        if text is not None:
+            # Try to find USD rate (دلار)
+            start = text.find(_TGJU_USD_MARKER)
+            if start < 0:
+                return {}
+            for pattern in _TGJU_MAIN_USD_RES:
+                for match_str in pattern.findall(text, max(start - 1, 0)):
+                    clean_rate = match_str.replace(',', '')
+                    if clean_rate.isdigit():
+                        test_rate = float(clean_rate)
+                        if 500000 <= test_rate <= 2000000:
+                            logging.info(f"Found USD to IRR rate from TGJU main page: {test_rate}")
+                            return {'USD_to_IRR': test_rate}
+    except Exception as e:
+        logging.warning(f"Failed to get rates from TGJU main page: {e}")
+    return {}
+
+def _fetch_boc_usd():
+    """STEP 4: CAD to USD rate from the Bank of Canada for cross-conversions"""
+    try:
+        response = _HTTP.get("https://www.bankofcanada.ca/valet/observations/FXUSDCAD/json?recent=1", timeout=_HTTP_TIMEOUT, headers=_JSON_HEADERS)
         if response.status_code == 200:
-            data = response.json()
+            data = json.loads(response.content)  # bytes in: no separate text decode
             if 'observations' in data and len(data['observations']) > 0:
                 usd_cad_rate = float(data['observations'][0]['FXUSDCAD']['v'])
                 if usd_cad_rate > 0:
                     cad_usd_rate = 1 / usd_cad_rate
                     if 0.60 <= cad_usd_rate <= 0.90:
-                        rates['USD'] = cad_usd_rate
                         logging.info(f"Got CAD/USD rate from Bank of Canada: {cad_usd_rate}")
+                        return {'USD': cad_usd_rate}
     except Exception as e:
         logging.warning(f"Failed to get USD rate from Bank of Canada: {e}")
+    return {}
+
+def _fetch_exchangerates_api_usd():
+    """Alternative CAD to USD source if the Bank of Canada failed"""
+    try:
+        response = _HTTP.get("https://api.exchangerates-api.io/v1/latest?base=CAD&symbols=USD", timeout=_HTTP_TIMEOUT, headers=_JSON_HEADERS)
+        if response.status_code == 200:
+            data = json.loads(response.content)  # bytes in: no separate text decode
+            if data.get('success', True) and 'rates' in data:
+                if 'USD' in data['rates']:
+                    usd_rate = float(data['rates']['USD'])
+                    if 0.60 <= usd_rate <= 0.90:
+                        logging.info(f"Got CAD/USD rate from exchangerates-api.io: {usd_rate}")
+                        return {'USD': usd_rate}
+    except Exception as e:
+        logging.warning(f"Failed to get USD rate from exchangerates-api.io: {e}")
+    return {}
+
+_RATES_REFRESH_LOCK = threading.Lock()
+
+# Keys of the get_exchange_rates() dict and the stored (from, to) pair for each
+_RATE_PAIRS = {
+    'USD_to_IRR': ('USD', 'IRR'),
+    'IRR': ('CAD', 'IRR'),
+    'USD': ('CAD', 'USD'),
+}
+
+def get_exchange_rates(force=False):
+    """Fetch live exchange rates from tgju.org - all rates fetched directly, no hardcoded values"""
+    # Check cache first (cache for 15 minutes to avoid repeated API calls)
+    cached_rates = None if force else get_cached_value('exchange_rates', 15)
+    if cached_rates is not None:
+        logging.debug("Using cached exchange rates")
+        return cached_rates
     
-    # Try alternative sources for CAD/USD if Bank of Canada failed
-    if 'USD' not in rates:
-        try:
-            response = requests.get("https://api.exchangerates-api.io/v1/latest?base=CAD&symbols=USD", timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('success', True) and 'rates' in data:
-                    if 'USD' in data['rates']:
-                        usd_rate = float(data['rates']['USD'])
-                        if 0.60 <= usd_rate <= 0.90:
-                            rates['USD'] = usd_rate
-                            logging.info(f"Got CAD/USD rate from exchangerates-api.io: {usd_rate}")
-        except Exception as e:
-            logging.warning(f"Failed to get USD rate from exchangerates-api.io: {e}")
+    # One refresh per process at a time: threads that missed the cache together
+    # wait for the first refresh and reuse its result instead of repeating it
+    with _RATES_REFRESH_LOCK:
+        if not force:
+            cached_rates = get_cached_value('exchange_rates', 15)
+            if cached_rates is not None:
+                return cached_rates
+        return _refresh_exchange_rates()
+
+def _refresh_exchange_rates():
+    """Fetch every rate source, store the results and cache them"""
+    logging.debug("Fetching fresh exchange rates from tgju.org")
     
-    # STEP 5: If online sources failed, try database cache (no hardcoded values)
-    if 'USD_to_IRR' not in rates:
-        try:
-            recent_rate = ExchangeRate.query.filter_by(
-                from_currency='USD', 
-                to_currency='IRR'
-            ).order_by(ExchangeRate.updated_at.desc()).first()
-            
-            if recent_rate and recent_rate.updated_at:
-                time_diff = datetime.utcnow() - recent_rate.updated_at
-                if time_diff.total_seconds() < 86400:  # 24 hours
-                    rates['USD_to_IRR'] = recent_rate.rate
-                    logging.info(f"Using cached database USD to IRR rate: {recent_rate.rate}")
-                else:
-                    logging.warning("Database USD to IRR rate is too old (>24h), cannot use")
-            else:
-                logging.warning("No USD to IRR rate in database")
-        except Exception as e:
-            logging.warning(f"Failed to get USD to IRR rate from database: {e}")
+    # Late imports to avoid circular dependency
+    from .models import ExchangeRate
+    from .app import db, dialect_insert
     
-    if 'IRR' not in rates:
-        try:
-            recent_rate = ExchangeRate.query.filter_by(
-                from_currency='CAD', 
-                to_currency='IRR'
-            ).order_by(ExchangeRate.updated_at.desc()).first()
-            
-            if recent_rate and recent_rate.updated_at:
-                time_diff = datetime.utcnow() - recent_rate.updated_at
-                if time_diff.total_seconds() < 86400:  # 24 hours
-                    rates['IRR'] = recent_rate.rate
-                    logging.info(f"Using cached database CAD to IRR rate: {recent_rate.rate}")
-                else:
-                    logging.warning("Database CAD to IRR rate is too old (>24h), cannot use")
-            else:
-                logging.warning("No CAD to IRR rate in database")
-        except Exception as e:
-            logging.warning(f"Failed to get CAD to IRR rate from database: {e}")
+    # The primary sources are independent, so fetch them concurrently; wall
+    # time becomes the slowest single call instead of the sum of all of them
+    rates = _run_fetchers([_fetch_tgju_usd, _fetch_tgju_cad, _fetch_boc_usd])
     
+    # Fallback sources, only for whatever the primary sources did not provide
+    fallbacks = []
+    if 'USD_to_IRR' not in rates:
+        fallbacks.append(_fetch_tgju_main_usd)
     if 'USD' not in rates:
+        fallbacks.append(_fetch_exchangerates_api_usd)
+    if fallbacks:
+        rates.update(_run_fetchers(fallbacks))
+    
+    # STEP 5: If online sources failed, try database cache (no hardcoded values).
+    # Each pair is unique, so one small SELECT covers every missing rate.
+    missing = [key for key in _RATE_PAIRS if key not in rates]
+    if missing:
         try:
-            recent_rate = ExchangeRate.query.filter_by(
-                from_currency='CAD', 
-                to_currency='USD'
-            ).order_by(ExchangeRate.updated_at.desc()).first()
-            
-            if recent_rate and recent_rate.updated_at:
-                time_diff = datetime.utcnow() - recent_rate.updated_at
-                if time_diff.total_seconds() < 86400:  # 24 hours
-                    rates['USD'] = recent_rate.rate
-                    logging.info(f"Using cached database CAD to USD rate: {recent_rate.rate}")
+            stored = {
+                (row.from_currency, row.to_currency): row
+                for row in db.session.execute(db.select(
+                    ExchangeRate.from_currency, ExchangeRate.to_currency,
+                    ExchangeRate.rate, ExchangeRate.updated_at,
+                ))
+            }
+            for key in missing:
+                from_currency, to_currency = _RATE_PAIRS[key]
+                recent_rate = stored.get((from_currency, to_currency))
+                if recent_rate and recent_rate.updated_at:
+                    time_diff = datetime.utcnow() - recent_rate.updated_at
+                    if time_diff.total_seconds() < 86400:  # 24 hours
+                        rates[key] = recent_rate.rate
+                        logging.info(f"Using cached database {from_currency} to {to_currency} rate: {recent_rate.rate}")
+                    else:
+                        logging.warning(f"Database {from_currency} to {to_currency} rate is too old (>24h), cannot use")
+                else:
+                    logging.warning(f"No {from_currency} to {to_currency} rate in database")
         except Exception as e:
-            logging.warning(f"Failed to get CAD to USD rate from database: {e}")
+            logging.warning(f"Failed to get exchange rates from database: {e}")
     
     # Log warning if rates are missing
     if 'USD_to_IRR' not in rates:
@@ -291,107 +352,94 @@ def get_exchange_rates():
     if 'IRR' not in rates:
         logging.error("CRITICAL: Could not fetch CAD to IRR rate from any source!")
     
-    # Update database with fetched rates
+    # Update database with fetched rates - one multi-row upsert keyed on the
+    # (from_currency, to_currency) pair instead of a SELECT + write per rate
     try:
-        for currency, rate in rates.items():
-            if currency == 'USD_to_IRR':
-                # Store USD to IRR rate
-                existing_rate = ExchangeRate.query.filter_by(
-                    from_currency='USD', 
-                    to_currency='IRR'
-                ).first()
-                
-                if existing_rate:
-                    existing_rate.rate = rate
-                    existing_rate.updated_at = datetime.utcnow()
-                else:
-                    new_rate = ExchangeRate()
-                    new_rate.from_currency = 'USD'
-                    new_rate.to_currency = 'IRR'
-                    new_rate.rate = rate
-                    db.session.add(new_rate)
-            else:
-                # Store CAD-based rates
-                existing_rate = ExchangeRate.query.filter_by(
-                    from_currency='CAD', 
-                    to_currency=currency
-                ).first()
-                
-                if existing_rate:
-                    existing_rate.rate = rate
-                    existing_rate.updated_at = datetime.utcnow()
-                else:
-                    new_rate = ExchangeRate()
-                    new_rate.from_currency = 'CAD'
-                    new_rate.to_currency = currency
-                    new_rate.rate = rate
-                    db.session.add(new_rate)
-        
-        db.session.commit()
-        logging.info(f"Updated exchange rates in database: {rates}")
+        now = datetime.utcnow()
+        pending = [
+            dict(from_currency=_RATE_PAIRS[key][0], to_currency=_RATE_PAIRS[key][1],
+                 rate=rate, updated_at=now)
+            for key, rate in rates.items()
+        ]
+        if pending:
+            stmt = dialect_insert(ExchangeRate.__table__).values(pending)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['from_currency', 'to_currency'],
+                set_={'rate': stmt.excluded.rate, 'updated_at': stmt.excluded.updated_at},
+            ))
+            db.session.commit()
+            clear_rate_map()
+            logging.info(f"Updated exchange rates in database: {rates}")
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Error updating exchange rates in database: {e}")
     
-    # Cache the rates for 15 minutes to avoid repeated API calls
-    set_cached_value('exchange_rates', rates, 15)
+    # Cache the rates for 15 minutes to avoid repeated API calls; a total
+    # outage is remembered briefly too, so callers do not retry every source
+    # on each request while the providers are down
+    set_cached_value('exchange_rates', rates, 15 if rates else 1)
     
     return rates
 
-def convert_currency(amount, from_currency, to_currency):
+_RATE_MAP_TTL_MINUTES = 5
+
+@lru_cache(maxsize=1)
+def _rate_map_stmt():
+    """SELECT of every stored rate pair, built once and reused"""
+    # Late imports to avoid circular dependency
+    from .models import ExchangeRate
+    from .app import db
+    return db.select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.rate)
+
+def _load_rate_map():
+    """Stored exchange rates keyed by (from_currency, to_currency), from one cached query"""
+    rate_map = get_cached_value('rate_map', _RATE_MAP_TTL_MINUTES)
+    if rate_map is None:
+        from .app import db
+        
+        rows = db.session.execute(_rate_map_stmt()).all()
+        rate_map = {(from_currency, to_currency): rate for from_currency, to_currency, rate in rows}
+        set_cached_value('rate_map', rate_map, _RATE_MAP_TTL_MINUTES)
+    return rate_map
+
+def clear_rate_map():
+    """Drop the cached rate table after exchange rates are written or deleted"""
+    _cache.pop('rate_map', None)
+    _cache_ttl.pop('rate_map', None)
+
+def convert_currency(amount, from_currency, to_currency, rate_map=None):
     """Convert amount from one currency to another using live rates from database first"""
     if from_currency == to_currency:
         return amount
     
-    # Late import to avoid circular dependency
-    from .models import ExchangeRate
+    # One dict per call site instead of a query per conversion
+    if rate_map is None:
+        rate_map = _load_rate_map()
     
     # Priority 1: Get live exchange rate from database (most recent)
     if from_currency == 'CAD':
-        rate = ExchangeRate.query.filter_by(
-            from_currency='CAD',
-            to_currency=to_currency
-        ).order_by(ExchangeRate.updated_at.desc()).first()
+        rate = rate_map.get(('CAD', to_currency))
         if rate:
-            logging.debug(f"Using database rate CAD->{to_currency}: {rate.rate}")
-            return amount * rate.rate
+            logging.debug(f"Using database rate CAD->{to_currency}: {rate}")
+            return amount * rate
     elif to_currency == 'CAD':
-        rate = ExchangeRate.query.filter_by(
-            from_currency='CAD',
-            to_currency=from_currency
-        ).order_by(ExchangeRate.updated_at.desc()).first()
+        # Also covers USD->CAD by inverting the stored CAD->USD rate
+        rate = rate_map.get(('CAD', from_currency))
         if rate:
-            logging.debug(f"Using database rate {from_currency}->CAD: {1/rate.rate}")
-            return amount / rate.rate
+            logging.debug(f"Using database rate {from_currency}->CAD: {1/rate}")
+            return amount / rate
     
     # Priority 2: Try USD to IRR direct conversion from database
     if from_currency == 'USD' and to_currency == 'IRR':
-        rate = ExchangeRate.query.filter_by(
-            from_currency='USD',
-            to_currency='IRR'
-        ).order_by(ExchangeRate.updated_at.desc()).first()
+        rate = rate_map.get(('USD', 'IRR'))
         if rate:
-            logging.debug(f"Using database rate USD->IRR: {rate.rate}")
-            return amount * rate.rate
+            logging.debug(f"Using database rate USD->IRR: {rate}")
+            return amount * rate
     elif from_currency == 'IRR' and to_currency == 'USD':
-        rate = ExchangeRate.query.filter_by(
-            from_currency='USD',
-            to_currency='IRR'
-        ).order_by(ExchangeRate.updated_at.desc()).first()
+        rate = rate_map.get(('USD', 'IRR'))
         if rate:
-            logging.debug(f"Using database rate IRR->USD: {1/rate.rate}")
-            return amount / rate.rate
-    
-    # Priority 3: Try cross-currency conversion through database rates
-    if from_currency == 'USD' and to_currency == 'CAD':
-        # Get CAD->USD rate and invert it
-        cad_usd_rate = ExchangeRate.query.filter_by(
-            from_currency='CAD',
-            to_currency='USD'
-        ).order_by(ExchangeRate.updated_at.desc()).first()
-        if cad_usd_rate:
-            usd_cad_rate = 1 / cad_usd_rate.rate
-            logging.debug(f"Using inverted database rate USD->CAD: {usd_cad_rate}")
-            return amount * usd_cad_rate
+            logging.debug(f"Using database rate IRR->USD: {1/rate}")
+            return amount / rate
     
     # Priority 4: Fresh API call if no database rates available
     logging.debug(f"No database rate found for {from_currency}->{to_currency}, refreshing rates")
@@ -415,67 +463,90 @@ def convert_currency(amount, from_currency, to_currency):
     # Return original amount with warning - don't use hardcoded values
     return amount
 
+@lru_cache(maxsize=1)
+def _inventory_version_stmt():
+    """Data-version probe, built once since it runs on every stats lookup"""
+    # Late imports to avoid circular dependency
+    from .models import Purchase, Sale
+    from .app import db
+    
+    # Any purchase/sale insert or delete changes the row count or highest id,
+    # so this one probe detects writes from every worker. The totals cover a
+    # reset on SQLite, where DELETE lets new rows reuse the old ids.
+    purchases = db.select(
+        db.func.count(Purchase.id), db.func.max(Purchase.id),
+        db.func.sum(Purchase.gold_amount), db.func.sum(Purchase.total_cost),
+    ).subquery()
+    sales = db.select(
+        db.func.count(Sale.id), db.func.max(Sale.id),
+        db.func.sum(Sale.gold_amount), db.func.sum(Sale.total_revenue),
+    ).subquery()
+    return db.select(purchases, sales)
+
 def calculate_inventory_and_profit():
     """Calculate remaining WoW gold inventory and profit using FIFO method"""
-    # Check cache first (cache for 5 minutes since this is expensive calculation)
-    cached_stats = get_cached_value('inventory_stats', 5)
-    if cached_stats:
-        logging.debug("Using cached inventory and profit stats")
-        return cached_stats
-    
-    logging.debug("Calculating fresh inventory and profit stats")
-    
     # Late imports to avoid circular dependency
     from .models import Purchase, Sale
+    from .app import db
     
-    purchases = Purchase.query.order_by(Purchase.date, Purchase.id).all()
-    sales = Sale.query.order_by(Sale.date, Sale.id).all()
+    version = tuple(db.session.execute(_inventory_version_stmt()).one())
     
-    # Convert all purchases to CAD for consistent calculation
-    inventory_queue = []
-    total_purchase_cost_cad = 0
+    # Check cache first (cache for 5 minutes since conversions use live rates)
+    cached = get_cached_value('inventory_stats', 5)
+    if cached and cached[0] == version:
+        logging.debug("Using cached inventory and profit stats")
+        return cached[1]
     
-    for purchase in purchases:
-        # Convert price per 1k tokens to cost per token in CAD
-        cost_per_token_cad = purchase.unit_price / 1000  # price per 1k to price per 1 token
-        if purchase.currency == 'IRR':
-            cost_per_token_cad = convert_currency(purchase.unit_price, 'IRR', 'CAD') / 1000
-        
-        inventory_queue.append({
-            'amount': purchase.gold_amount,  # WoW gold tokens
-            'cost_per_token': cost_per_token_cad  # Cost per single token in CAD
-        })
-        total_purchase_cost_cad += purchase.gold_amount * cost_per_token_cad
-    
-    # Process sales using FIFO
-    total_sales_revenue = sum(sale.total_revenue for sale in sales)
-    total_cost_of_goods_sold = 0
-    
-    for sale in sales:
-        remaining_to_sell = sale.gold_amount
-        
-        while remaining_to_sell > 0 and inventory_queue:
-            batch = inventory_queue[0]
-            
-            if batch['amount'] <= remaining_to_sell:
-                # Use entire batch
-                total_cost_of_goods_sold += batch['amount'] * batch['cost_per_token']
-                remaining_to_sell -= batch['amount']
-                inventory_queue.pop(0)
-            else:
-                # Use partial batch
-                total_cost_of_goods_sold += remaining_to_sell * batch['cost_per_token']
-                batch['amount'] -= remaining_to_sell
-                remaining_to_sell = 0
+    logging.debug("Calculating fresh inventory and profit stats")
     
-    # Calculate remaining inventory
-    remaining_inventory = sum(batch['amount'] for batch in inventory_queue)
-    remaining_inventory_value = sum(batch['amount'] * batch['cost_per_token'] for batch in inventory_queue)
+    # Sales only contribute totals (FIFO needs just the amount sold overall),
+    # so the database adds them up instead of shipping every row
+    total_sales_revenue, total_sold = db.session.execute(
+        db.select(db.func.sum(Sale.total_revenue), db.func.sum(Sale.gold_amount))
+    ).one()
+    total_sales_revenue = total_sales_revenue or 0
+    total_sold = total_sold or 0
+    
+    # Convert all purchases to CAD for consistent calculation. The IRR rate is
+    # resolved once (convert_currency() is linear, so its factor for 1 IRR
+    # carries every fallback) and applied inside the query.
+    rate_map = _load_rate_map()
+    cad_per_irr = convert_currency(1.0, 'IRR', 'CAD', rate_map)
+    # Cost per single token in CAD (unit_price is per 1000 tokens)
+    cost_per_token_cad = db.case(
+        (Purchase.currency == 'IRR', Purchase.unit_price * cad_per_irr),
+        else_=Purchase.unit_price,
+    ) / 1000
+    
+    # FIFO in SQL: every sale draws from the oldest stock, so together the
+    # sales consume the first ``total_sold`` tokens in (date, id) order. A
+    # running total gives each batch the tokens bought before it, and from
+    # that how much of the batch was consumed.
+    batches = db.select(
+        Purchase.gold_amount.label('amount'),
+        cost_per_token_cad.label('cost'),
+        (db.func.sum(Purchase.gold_amount).over(order_by=(Purchase.date, Purchase.id))
+         - Purchase.gold_amount).label('bought_before'),
+    ).subquery()
+    consumed = db.case(
+        (batches.c.bought_before >= total_sold, 0),
+        (batches.c.bought_before + batches.c.amount <= total_sold, batches.c.amount),
+        else_=total_sold - batches.c.bought_before,
+    )
+    total_purchased, total_purchase_cost_cad, total_cost_of_goods_sold = db.session.execute(db.select(
+        db.func.coalesce(db.func.sum(batches.c.amount), 0),
+        db.cast(db.func.coalesce(db.func.sum(batches.c.amount * batches.c.cost), 0), db.Float),
+        db.cast(db.func.coalesce(db.func.sum(consumed * batches.c.cost), 0), db.Float),
+    )).one()
+    
+    # Sales beyond the stock on hand consume nothing further
+    remaining_inventory = total_purchased - min(total_sold, total_purchased)
+    remaining_inventory_value = total_purchase_cost_cad - total_cost_of_goods_sold
     
     # Calculate profit
     profit_cad = total_sales_revenue - total_cost_of_goods_sold
-    profit_usd = convert_currency(profit_cad, 'CAD', 'USD')
-    profit_irr = convert_currency(profit_cad, 'CAD', 'IRR')
+    profit_usd = convert_currency(profit_cad, 'CAD', 'USD', rate_map)
+    profit_irr = convert_currency(profit_cad, 'CAD', 'IRR', rate_map)
     
     stats = {
         'remaining_inventory': remaining_inventory,  # WoW gold tokens remaining
@@ -485,15 +556,87 @@ def calculate_inventory_and_profit():
         'profit_cad': profit_cad,
         'profit_usd': profit_usd,
         'profit_irr': profit_irr,
-        'total_purchased': sum(p.gold_amount for p in purchases),
-        'total_sold': sum(s.gold_amount for s in sales)
+        'total_purchased': total_purchased,
+        'total_sold': total_sold
     }
     
-    # Cache the stats for 5 minutes since this is an expensive calculation
-    set_cached_value('inventory_stats', stats, 5)
+    # Cache the stats for 5 minutes, tagged with the data version they reflect
+    set_cached_value('inventory_stats', (version, stats), 5)
     
     return stats
 
+class TransactionCreator(namedtuple('TransactionCreator', 'first_name last_name photo_url')):
+    """The parts of a User that transaction listings render"""
+    __slots__ = ()
+    
+    @property
+    def full_name(self):
+        if self.last_name:
+            return f"{self.first_name} {self.last_name}"
+        return self.first_name
+
+def get_recent_transactions(limit=3):
+    """Newest purchases and sales, with their creators, in one UNION ALL round trip"""
+    from .models import Purchase, Sale, User
+    from .app import db
+    
+    def newest(kind, model, seller, currency):
+        # Each branch is wrapped as a subquery so its ORDER BY/LIMIT is valid on SQLite too
+        return db.select(db.select(
+            db.literal(kind).label('kind'), model.id, model.date, model.created_at, model.gold_amount,
+            model.unit_price, seller.label('seller'), currency.label('currency'),
+            User.first_name, User.last_name, User.photo_url,
+        ).join(User, model.created_by == User.id)
+         .order_by(model.created_at.desc()).limit(limit).subquery())
+    
+    rows = db.session.execute(db.union_all(
+        newest('purchase', Purchase, Purchase.seller, Purchase.currency),
+        newest('sale', Sale, db.null(), db.cast(db.literal('CAD'), Purchase.currency.type)),
+    )).all()
+    # UNION ALL does not promise to keep each branch's ordering
+    rows.sort(key=lambda row: row.created_at or datetime.min, reverse=True)
+    
+    recent = {'purchase': [], 'sale': []}
+    for row in rows:
+        recent[row.kind].append(SimpleNamespace(
+            id=row.id, date=row.date, gold_amount=row.gold_amount, unit_price=row.unit_price,
+            seller=row.seller, currency=row.currency,
+            creator=TransactionCreator(row.first_name, row.last_name, row.photo_url),
+        ))
+    return recent['purchase'], recent['sale']
+
+class CachedUser:
+    """Lightweight stand-in for User built from the session's cached profile"""
+    __slots__ = ('id', 'telegram_id', 'first_name', 'last_name', 'username',
+                 'photo_url', 'is_whitelisted', 'is_admin')
+    
+    def __init__(self, session, data):
+        self.id = session['user_id']
+        self.telegram_id = session.get('telegram_id')
+        self.first_name = data.get('first_name', '')
+        self.last_name = data.get('last_name', '')
+        self.username = data.get('username', '')
+        self.photo_url = data.get('photo_url', '')
+        self.is_whitelisted = data.get('is_whitelisted', False)
+        self.is_admin = data.get('is_admin', False)
+    
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}".strip()
+
+def get_remaining_inventory():
+    """Gold tokens in stock, computed as a single SQL aggregate"""
+    from .models import Purchase, Sale
+    from .app import db
+    
+    purchased, sold = db.session.execute(db.select(
+        db.select(db.func.coalesce(db.func.sum(Purchase.gold_amount), 0)).scalar_subquery(),
+        db.select(db.func.coalesce(db.func.sum(Sale.gold_amount), 0)).scalar_subquery(),
+    )).one()
+    # Every purchase is queued before sales are applied in the FIFO calculation,
+    # so its remaining inventory is exactly this difference floored at zero
+    return max(0, purchased - sold)
+
 def get_user_from_session(session):
     """Get user data from session cache or database as fallback"""
     # Try to get cached user data from session first
@@ -501,36 +644,27 @@ def get_user_from_session(session):
         cached_data = session['cached_user_data']
         # Check if cache is not too old (less than 1 hour)
         if 'cached_at' in cached_data:
-            from datetime import datetime
             try:
                 cached_time = datetime.fromisoformat(cached_data['cached_at'])
                 if (datetime.utcnow() - cached_time).seconds < 3600:  # 1 hour
-                    # Create a simple user object from cached data
-                    class CachedUser:
-                        def __init__(self, data):
-                            self.id = session['user_id']
-                            self.telegram_id = session.get('telegram_id')
-                            self.first_name = data.get('first_name', '')
-                            self.last_name = data.get('last_name', '')
-                            self.username = data.get('username', '')
-                            self.photo_url = data.get('photo_url', '')
-                            self.is_whitelisted = data.get('is_whitelisted', False)
-                            self.is_admin = data.get('is_admin', False)
-                            
-                        @property
-                        def full_name(self):
-                            return f"{self.first_name} {self.last_name}".strip()
-                    
-                    return CachedUser(cached_data)
+                    return CachedUser(session, cached_data)
             except (ValueError, TypeError):
                 pass
     
     # Fallback to database query if cache miss or invalid
-    if 'user_id' in session:
-        from .models import User
-        return User.query.get(session['user_id'])
-    
-    return None
+    return load_session_user(session)
+
+def load_session_user(session):
+    """Database User for the session, loaded at most once per request"""
+    from flask import g
+    if 'session_user' not in g:
+        if 'user_id' in session:
+            from .models import User
+            from .app import db
+            g.session_user = db.session.get(User, session['user_id'])
+        else:
+            g.session_user = None
+    return g.session_user
 
 def clear_inventory_cache():
     """Clear inventory cache when data changes"""
@@ -538,3 +672,9 @@ def clear_inventory_cache():
         del _cache['inventory_stats']
     if 'inventory_stats' in _cache_ttl:
         del _cache_ttl['inventory_stats']
+
+def clear_settings_cache():
+    """Drop cached Settings values after bulk changes to the settings table"""
+    for key in [k for k in _cache if k.startswith('setting:')]:
+        _cache.pop(key, None)
+        _cache_ttl.pop(key, None)